@@ -0,0 +1,72 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from core.versions import get_versions
+
+RESPONSE_KEY = 'response:{}'
+STALE_KEY = 'response-stale:{}'
+LOCK_KEY = 'response-lock:{}'
+
+
+class AnonymousCacheMixin:
+    """
+    Кэш ответов list и retrieve для анонимных GET.
+    В ключе - запрос и версии данных из get_cache_versions(),
+    поэтому после правки старый ответ свежим уже не считается.
+    Пока один процесс пересобирает ответ (например, БД тормозит),
+    остальные отдают последнюю собранную версию.
+    """
+
+    def get_cache_versions(self):
+        """Имена наборов данных (core.versions), от которых зависит ответ."""
+
+        raise NotImplementedError
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, *args, **kwargs)
+
+    def get_cached_response(self, view, *args, **kwargs):
+        request = self.request
+        if request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        # Ссылки в ответе абсолютные, поэтому хост - тоже часть ключа.
+        request_key = hashlib.sha256(
+            f'{request.build_absolute_uri()} '
+            f'{request.accepted_renderer.format}'.encode()
+        ).hexdigest()
+        versions = get_versions(*self.get_cache_versions())
+        key = RESPONSE_KEY.format(hashlib.sha256(
+            f'{request_key} {versions}'.encode()
+        ).hexdigest())
+        data = cache.get(key)
+        if data is not None:
+            return Response(data, headers={'X-Cache': 'HIT'})
+        stale_key = STALE_KEY.format(request_key)
+        lock_key = LOCK_KEY.format(request_key)
+        locked = cache.add(lock_key, True, timeout=getattr(
+            settings, 'RESPONSE_CACHE_REVALIDATE_TIMEOUT', 30
+        ))
+        if not locked:
+            data = cache.get(stale_key)
+            if data is not None:
+                return Response(data, headers={'X-Cache': 'STALE'})
+        try:
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response.data, getattr(
+                    settings, 'RESPONSE_CACHE_TIMEOUT', 600
+                ))
+                cache.set(stale_key, response.data, getattr(
+                    settings, 'RESPONSE_CACHE_STALE_TIMEOUT', 60 * 60 * 24
+                ))
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        response['X-Cache'] = 'MISS'
+        return response
@@ -1,9 +1,16 @@
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filters
 
-from recipes.models import Recipe, Tag
+from recipes.models import Favorite, Recipe, RecipeTag, ShoppingCart, Tag
 
 
 class RecipeFilter(filters.FilterSet):
+    """
+    Фильтры рецептов. Связи проверяются подзапросами EXISTS,
+    поэтому каждый рецепт попадает в выборку один раз - без JOIN
+    и DISTINCT, сколько бы тегов ни совпало.
+    """
+
     is_favorited = filters.BooleanFilter(method='get_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart'
@@ -12,24 +19,49 @@ class RecipeFilter(filters.FilterSet):
         field_name='tags__slug',
         queryset=Tag.objects.all(),
         label='Tags',
-
+        method='get_tags',
         to_field_name='slug'
     )
 
+    # Фильтры по данным текущего пользователя.
+    user_filters = ('is_favorited', 'is_in_shopping_cart')
+
     class Meta:
         model = Recipe
         fields = ('is_favorited', 'is_in_shopping_cart', 'author')
 
+    def filter_by_user(self, queryset, model):
+        """Рецепты, связанные с текущим пользователем через model."""
+
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.none()
+        return queryset.filter(
+            Exists(model.objects.filter(user=user, recipe=OuterRef('pk')))
+        )
+
+    def get_tags(self, queryset, name, value):
+        """Фильтрация queryset по любому из тегов."""
+
+        # Без тегов поле отдаёт пустой QuerySet, а не [].
+        if not value:
+            return queryset
+        return queryset.filter(
+            Exists(
+                RecipeTag.objects.filter(recipe=OuterRef('pk'), tag__in=value)
+            )
+        )
+
     def get_is_favorited(self, queryset, name, value):
         """Фильтрация queryset по полю is_favorited."""
 
         if value:
-            return queryset.filter(favorites__user=self.request.user)
+            return self.filter_by_user(queryset, Favorite)
         return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         """Фильтрация queryset по полю is_in_shopping_cart."""
 
         if value:
-            return queryset.filter(shopping_cart__user=self.request.user)
+            return self.filter_by_user(queryset, ShoppingCart)
         return queryset
@@ -1,7 +1,227 @@
+import hashlib
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from json import dumps, loads
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from core.parametrs import Parameters
+from core.versions import get_versions
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator, который берёт общее число объектов из кэша.
+    Кэшируется только при заданных versions - версиях данных
+    (core.versions), от которых зависит выборка: они входят в ключ
+    вместе с SQL подсчёта, поэтому после изменения данных число
+    пересчитывается. В SQL подсчёта нет флагов пользователя
+    (is_favorited и т.п.), так что без фильтров по его данным ключ
+    общий для анонимов и пользователей. Точный COUNT(*) делается
+    не чаще раза в PAGINATION_COUNT_CACHE_TIMEOUT секунд.
+    """
+
+    def __init__(self, *args, versions=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.versions = versions
+
+    @cached_property
+    def count(self):
+        try:
+            sql, params = self.object_list.order_by().values(
+                'pk'
+            ).query.sql_with_params()
+        except EmptyResultSet:
+            # Заведомо пустая выборка, например .none() или pk__in=[].
+            return 0
+        if self.versions is None:
+            return super().count
+        key = 'count:' + hashlib.sha256(
+            f'{sql}{params}{self.versions}'.encode()
+        ).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(
+                key, count,
+                getattr(settings, 'PAGINATION_COUNT_CACHE_TIMEOUT', 30)
+            )
+        return count
+
+    def page(self, number):
+        """
+        Страница читается с одним лишним объектом, а не срезом
+        по count: устаревшее число из кэша не обрезает страницу,
+        а по прочитанному уточняется.
+        """
+
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(
+                gettext_lazy('That page number is not an integer')
+            )
+        if number < 1:
+            raise EmptyPage(gettext_lazy('That page number is less than 1'))
+        bottom = (number - 1) * self.per_page
+        objects = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not objects and number > 1:
+            raise EmptyPage(gettext_lazy('That page contains no results'))
+        if len(objects) <= self.per_page:
+            # Последняя страница: число объектов известно точно.
+            self.set_count(bottom + len(objects))
+        elif self.count <= bottom + self.per_page:
+            self.set_count(bottom + len(objects))
+        return self._get_page(objects[:self.per_page], number, self)
+
+    def set_count(self, count):
+        self.__dict__['count'] = count
+        # num_pages посчитан по старому count.
+        self.__dict__.pop('num_pages', None)
 
 
 class CustomPagination(PageNumberPagination):
+    """
+    Постраничная пагинация page/limit с ограничением размера страницы.
+    Если передан параметр cursor (в том числе пустой), а у вьюхи
+    задан cursor_ordering, включается keyset-пагинация по этим полям:
+    без OFFSET и без подсчёта общего числа объектов.
+    Вьюха с cursor_only = True всегда пагинируется курсором.
+    cursor_ordering задаёт порядок и для страниц page.
+    """
+
     page_size_query_param = 'limit'
     page_size = 6
     page_query_param = 'page'
+    max_page_size = Parameters.MAX_PAGE_SIZE.value
+    cursor_query_param = 'cursor'
+
+    def django_paginator_class(self, object_list, per_page):
+        """
+        Число объектов кэшируется у вьюх с get_count_versions(),
+        если она вернула версии, а не None (выборка зависит от данных
+        пользователя, у которых версий нет).
+        """
+
+        versions = None
+        get_count_versions = getattr(self.view, 'get_count_versions', None)
+        if get_count_versions is not None:
+            names = get_count_versions()
+            if names is not None:
+                versions = get_versions(*names)
+        return CachedCountPaginator(object_list, per_page, versions=versions)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.view = view
+        self.cursor_ordering = getattr(view, 'cursor_ordering', None)
+        if self.cursor_ordering:
+            # Страницы и курсор идут в одном порядке.
+            queryset = queryset.order_by(*self.cursor_ordering)
+        if self.cursor_ordering and (
+            getattr(view, 'cursor_only', False)
+            or self.cursor_query_param in request.query_params
+        ):
+            return self.paginate_by_cursor(queryset, request)
+        self.cursor_ordering = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def paginate_by_cursor(self, queryset, request):
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(
+                self.get_cursor_filter(cursor, queryset)
+            )
+        objects = list(queryset[:page_size + 1])
+        self.next_cursor = None
+        if len(objects) > page_size:
+            objects = objects[:page_size]
+            self.next_cursor = self.encode_cursor(objects[-1])
+        return objects
+
+    def get_fields(self):
+        """Поля сортировки и направление: [(поле, по убыванию)]."""
+
+        return [
+            (field.lstrip('-'), field.startswith('-'))
+            for field in self.cursor_ordering
+        ]
+
+    def encode_cursor(self, obj):
+        values = []
+        for field, _ in self.get_fields():
+            # Страница может состоять из строк values().
+            value = (
+                obj[field] if isinstance(obj, dict) else getattr(obj, field)
+            )
+            values.append(
+                value.isoformat() if hasattr(value, 'isoformat') else value
+            )
+        return urlsafe_b64encode(dumps(values).encode()).decode()
+
+    def get_field(self, queryset, name):
+        """Поле модели или аннотации, по которому идёт сортировка."""
+
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.get_field(name)
+
+    def get_cursor_filter(self, cursor, queryset):
+        """
+        Условие "строго после курсора" для сортировки (f1, f2, ...):
+        f1 > v1 OR (f1 = v1 AND f2 > v2) OR ...
+        Значения курсора приводятся к типам полей, чтобы подделанный
+        курсор давал 404, а не ошибку базы.
+        """
+
+        fields = self.get_fields()
+        try:
+            values = loads(urlsafe_b64decode(cursor.encode()))
+            if not isinstance(values, list) or len(values) != len(fields):
+                raise ValueError
+            values = [
+                self.get_field(queryset, field).to_python(value)
+                for (field, _), value in zip(fields, values)
+            ]
+            if None in values:
+                raise ValueError
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound('Неверный курсор.')
+        condition = Q()
+        equal = Q()
+        for (field, descending), value in zip(fields, values):
+            lookup = 'lt' if descending else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def get_next_cursor_link(self):
+        if self.next_cursor is None:
+            return None
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.page_query_param
+        )
+        return replace_query_param(
+            url, self.cursor_query_param, self.next_cursor
+        )
+
+    def get_paginated_response(self, data):
+        if not self.cursor_ordering:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_cursor_link()),
+            ('previous', None),
+            ('results', data)
+        ]))
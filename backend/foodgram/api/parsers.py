@@ -0,0 +1,15 @@
+from rest_framework.parsers import FileUploadParser
+
+
+class ImageUploadParser(FileUploadParser):
+    """
+    Тело запроса - сам файл изображения (Content-Type: image/*).
+    Имя файла не обязательно: расширение задаётся по формату.
+    """
+
+    media_type = 'image/*'
+
+    def get_filename(self, stream, media_type, parser_context):
+        return super().get_filename(
+            stream, media_type, parser_context
+        ) or 'upload'
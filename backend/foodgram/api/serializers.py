@@ -1,16 +1,44 @@
+from collections import Counter, defaultdict
+from operator import itemgetter
+
 import webcolors
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.storage import default_storage
+from django.db import transaction
 from djoser.serializers import UserSerializer, UserCreateSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator
 from core.parametrs import Parameters
+from core.timing import measure
+from recipes.images import DERIVATIVES, get_derivative_name
 from recipes.models import (Tag, Recipe, RecipeIngredient,
-                            Ingredient, RecipeTag)
+                            Ingredient, RecipeTag, ShoppingListItem)
 from users.models import CustomUser
 from users.models import Subscription
+from .uploads import read_token
+
+
+class TimedSerializerMixin:
+    """Время to_representation попадает в замеры запроса."""
+
+    @measure('serializer')
+    def to_representation(self, instance):
+        return super().to_representation(instance)
+
+
+class SparseFieldsSerializerMixin:
+    """Аргумент fields оставляет в ответе только перечисленные поля."""
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
 
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(SparseFieldsSerializerMixin, TimedSerializerMixin,
+                           UserSerializer):
     """Сериализатор создания пользователя."""
 
     is_subscribed = serializers.SerializerMethodField(read_only=True)
@@ -28,15 +56,19 @@ class CustomUserSerializer(UserSerializer):
 
     def get_is_subscribed(self, obj):
         """
-        Дополнительное поле - проверка подписки, которое
-        никак не взаимодействует с базой данных.
+        Дополнительное поле - проверка подписки.
+        Берётся из аннотации with_subscription, запрос к базе
+        делается только для одиночного неаннотированного объекта.
         """
 
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
-
+        if request is None or obj == request.user:
+            return False
         return (
             request.user.is_authenticated
-            and request.user.subscription.exists()
+            and obj.author.filter(user=request.user).exists()
         )
 
 
@@ -54,12 +86,17 @@ class CustomUserCreateSerializer(UserCreateSerializer):
         )
 
 
-class ShowSubscriptionSerializer(serializers.ModelSerializer):
-    """Сериализатор для отображения подписок на пользователя."""
+class ShowSubscriptionSerializer(SparseFieldsSerializerMixin,
+                                 TimedSerializerMixin,
+                                 serializers.ModelSerializer):
+    """
+    Сериализатор для отображения подписок на пользователя.
+    Ожидает выборку, подготовленную во вьюсете: аннотацию
+    is_subscribed и список recent_recipes.
+    """
 
-    is_subscribed = serializers.SerializerMethodField()
+    is_subscribed = serializers.BooleanField(read_only=True)
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.ReadOnlyField(source='user_recipes.count')
 
     class Meta:
         model = CustomUser
@@ -74,21 +111,10 @@ class ShowSubscriptionSerializer(serializers.ModelSerializer):
             'recipes_count'
         )
 
-    def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        return (
-            request.user.is_authenticated
-            and request.user.subscription.exists()
-        )
-
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        if request is None or request.user.is_anonymous:
-            return False
-        recipes = Recipe.objects.filter(author=obj)
         return ShortRecipeSerializer(
-            recipes, many=True,
-            context={'request': request}
+            obj.recent_recipes, many=True,
+            context=self.context
         ).data
 
 
@@ -99,11 +125,6 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         model = Subscription
         fields = ('user', 'author')
 
-    def to_representation(self, instance):
-        return ShowSubscriptionSerializer(
-            instance.author, context=self.context
-        ).data
-
     def validate(self, data):
         if data['user'] == data['author']:
             raise serializers.ValidationError(
@@ -111,6 +132,16 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         return data
 
 
+class RecipeIdsSerializer(serializers.Serializer):
+    """Рецепты для массового добавления в избранное или корзину."""
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=Parameters.MAX_BULK_RECIPES.value
+    )
+
+
 class Hex2NameColor(serializers.Field):
     """
     Собственный тип суриализатора.
@@ -132,7 +163,7 @@ class Hex2NameColor(serializers.Field):
         self.validate_hex(data)
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор модели тег."""
 
     color = Hex2NameColor()
@@ -142,7 +173,7 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'color', 'slug')
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор модели ингредиент."""
 
     class Meta:
@@ -156,6 +187,77 @@ class IngredientSerializer(serializers.ModelSerializer):
         ]
 
 
+def build_url(name, request):
+    url = default_storage.url(name)
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def get_image_url(image, derivatives, variant, request):
+    """Ссылка на копию variant изображения, пока её нет - на исходник."""
+
+    if not image:
+        return None
+    name = get_derivative_name(image, derivatives, variant)
+    return build_url(name or image, request)
+
+
+def get_image_urls(image, derivatives, request):
+    """Ссылки на исходник и все готовые копии изображения."""
+
+    if not image:
+        return {}
+    images = {'original': build_url(image, request)}
+    for variant in DERIVATIVES:
+        name = get_derivative_name(image, derivatives, variant)
+        if name is not None:
+            images[variant] = build_url(name, request)
+    return images
+
+
+class RecipeImageField(Base64ImageField):
+    """
+    Изображение рецепта: на запись - токен из /api/uploads/
+    или base64, на чтение - ссылка на уменьшенную копию variant,
+    пока её нет - на исходник.
+    Без variant вариант берётся из context['image_variant'].
+    """
+
+    def __init__(self, variant=None, **kwargs):
+        self.variant = variant
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        request = self.context.get('request')
+        if isinstance(data, str) and request is not None:
+            # Файл уже в хранилище - полю достаточно его имени.
+            name = read_token(data, request.user)
+            if name is not None:
+                return name
+        return super().to_internal_value(data)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        return get_image_url(
+            value.name, value.instance.image_derivatives,
+            self.variant or self.context.get('image_variant', 'detail'),
+            self.context.get('request')
+        )
+
+
+class RecipeImagesField(serializers.ReadOnlyField):
+    """Ссылки на исходник и все готовые копии изображения рецепта."""
+
+    def __init__(self, **kwargs):
+        super().__init__(source='*', **kwargs)
+
+    def to_representation(self, recipe):
+        return get_image_urls(
+            recipe.image.name, recipe.image_derivatives,
+            self.context.get('request')
+        )
+
+
 class RecipeIngredientSerializer(serializers.ModelSerializer):
     """Сериализатор модели, которая связывает рецепт и ингредиенты."""
 
@@ -170,7 +272,7 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'amount', 'measurement_unit')
 
 
-class RecipesSerializer(serializers.ModelSerializer):
+class RecipesSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор модели рецепт."""
 
     tags = TagSerializer(many=True)
@@ -178,9 +280,10 @@ class RecipesSerializer(serializers.ModelSerializer):
         many=True, source='recipe_ingredients'
     )
     author = CustomUserSerializer()
-    is_favorited = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
-    image = Base64ImageField()
+    is_favorited = serializers.BooleanField(read_only=True)
+    is_in_shopping_cart = serializers.BooleanField(read_only=True)
+    image = RecipeImageField()
+    images = RecipeImagesField()
 
     class Meta:
         model = Recipe
@@ -188,47 +291,182 @@ class RecipesSerializer(serializers.ModelSerializer):
                   'ingredients', 'is_favorited',
                   'is_in_shopping_cart', 'name',
                   'text', 'cooking_time',
-                  'image'
+                  'image', 'images'
                   )
 
-    def get_is_favorited(self, obj):
-        """
-        Дополнительное поле, которое
-        никак не взаимодействует с базой данных.
-        """
 
-        request = self.context.get('request')
+class RecipeRowListSerializer(serializers.ListSerializer):
+    """Страница строк рецептов собирается одним проходом."""
 
-        return (
-            request.user.is_authenticated
-            and request.user.favorites.exists()
+    def to_representation(self, data):
+        return self.child.represent(list(data))
+
+
+class RecipeReadSerializer(serializers.BaseSerializer):
+    """
+    Быстрое чтение рецептов (list и retrieve). Отдаёт тот же JSON,
+    что и RecipesSerializer, но из строк values() и трёх запросов
+    на всю страницу (теги, ингредиенты, авторы) - без вложенных
+    сериализаторов и объектов полей на каждую строку.
+    Аргумент fields оставляет только нужные поля, запросы
+    для остальных не выполняются.
+    Совпадение с RecipesSerializer проверяют api.tests и
+    benchmark_serializers.
+    """
+
+    # Колонки строки values(), нужные полю ответа.
+    field_columns = {
+        'id': (),
+        'tags': (),
+        'author': ('author_id',),
+        'ingredients': (),
+        'is_favorited': ('is_favorited',),
+        'is_in_shopping_cart': ('is_in_shopping_cart',),
+        'name': ('name',),
+        'text': ('text',),
+        'cooking_time': ('cooking_time',),
+        'image': ('image', 'image_derivatives'),
+        'images': ('image', 'image_derivatives'),
+    }
+
+    class Meta:
+        list_serializer_class = RecipeRowListSerializer
+        fields = (
+            'id', 'tags', 'author', 'ingredients', 'is_favorited',
+            'is_in_shopping_cart', 'name', 'text', 'cooking_time', 'image',
+            'images'
         )
 
-    def get_is_in_shopping_cart(self, obj):
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.selected = self.Meta.fields if fields is None else fields
+
+    @classmethod
+    def get_row_fields(cls, fields=None):
         """
-        Дополнительное поле, которое
-        никак не взаимодействует с базой данных.
+        Колонки values() для полей ответа fields (None - все поля).
+        id и pub_date нужны всегда: по ним связи и пагинация.
         """
 
+        columns = dict.fromkeys(('id', 'pub_date'))
+        for field in cls.Meta.fields if fields is None else fields:
+            columns.update(dict.fromkeys(cls.field_columns[field]))
+        return tuple(columns)
+
+    def to_representation(self, row):
+        return self.represent([row])[0]
+
+    def get_tags(self, ids):
+        tags = defaultdict(list)
+        for recipe_id, pk, name, color, slug in RecipeTag.objects.filter(
+            recipe__in=ids
+        ).order_by('tag_id').values_list(
+            'recipe_id', 'tag_id', 'tag__name', 'tag__color', 'tag__slug'
+        ):
+            tags[recipe_id].append(
+                {'id': pk, 'name': name, 'color': color, 'slug': slug}
+            )
+        return tags
+
+    def get_ingredients(self, ids):
+        ingredients = defaultdict(list)
+        for recipe_id, pk, name, amount, unit in (
+            RecipeIngredient.objects.filter(recipe__in=ids).order_by(
+                'id'
+            ).values_list(
+                'recipe_id', 'ingredient_id', 'ingredient__name', 'amount',
+                'ingredient__measurement_unit'
+            )
+        ):
+            ingredients[recipe_id].append({
+                'id': pk, 'name': name, 'amount': amount,
+                'measurement_unit': unit
+            })
+        return ingredients
+
+    def get_authors(self, ids, user):
+        return {
+            pk: {
+                'id': pk, 'email': email, 'username': username,
+                'first_name': first_name, 'last_name': last_name,
+                'is_subscribed': is_subscribed
+            }
+            for pk, email, username, first_name, last_name, is_subscribed
+            in CustomUser.objects.with_subscription(user).filter(
+                pk__in=ids
+            ).values_list(
+                'id', 'email', 'username', 'first_name', 'last_name',
+                'is_subscribed'
+            )
+        }
+
+    @measure('serializer')
+    def represent(self, rows):
+        if not rows:
+            return []
         request = self.context.get('request')
-        return (
-            request.user.is_authenticated
-            and request.user.shopping_cart.exists()
-        )
+        user = request.user if request is not None else AnonymousUser()
+        variant = self.context.get('image_variant', 'detail')
+        ids = [row['id'] for row in rows]
+        fields = self.selected
+        if 'tags' in fields:
+            tags = self.get_tags(ids)
+        if 'ingredients' in fields:
+            ingredients = self.get_ingredients(ids)
+        if 'author' in fields:
+            authors = self.get_authors(
+                {row['author_id'] for row in rows}, user
+            )
+        images = {}
+
+        def get_images(row):
+            # Одно изображение бывает у многих рецептов,
+            # ссылки на него строятся один раз.
+            key = (
+                row['image'],
+                tuple(sorted(row['image_derivatives'].items()))
+            )
+            if key not in images:
+                images[key] = (
+                    get_image_url(
+                        row['image'], row['image_derivatives'], variant,
+                        request
+                    ),
+                    get_image_urls(
+                        row['image'], row['image_derivatives'], request
+                    )
+                )
+            return images[key]
+
+        getters = {
+            'id': itemgetter('id'),
+            'tags': lambda row: tags[row['id']],
+            'author': lambda row: authors[row['author_id']],
+            'ingredients': lambda row: ingredients[row['id']],
+            'is_favorited': itemgetter('is_favorited'),
+            'is_in_shopping_cart': itemgetter('is_in_shopping_cart'),
+            'name': itemgetter('name'),
+            'text': itemgetter('text'),
+            'cooking_time': itemgetter('cooking_time'),
+            'image': lambda row: get_images(row)[0],
+            'images': lambda row: get_images(row)[1],
+        }
+        getters = [(field, getters[field]) for field in fields]
+        return [{field: get(row) for field, get in getters} for row in rows]
 
 
 class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        source='ingredient',
-        queryset=Ingredient.objects.all()
-    )
-    measurement_unit = serializers.ReadOnlyField(
-        source='ingredient.measurement_unit'
-    )
+    """
+    Ингредиент в запросе на создание рецепта.
+    Сами объекты Ingredient подгружает RecipeCreateSerializer
+    одним запросом на все строки.
+    """
+
+    id = serializers.IntegerField()
 
     class Meta:
         model = RecipeIngredient
-        fields = ('id', 'amount', 'measurement_unit')
+        fields = ('id', 'amount')
 
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
@@ -236,11 +474,9 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
 
     ingredients = RecipeIngredientCreateSerializer(many=True)
 
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True
-    )
+    tags = serializers.ListField(child=serializers.IntegerField())
 
-    image = Base64ImageField()
+    image = RecipeImageField()
 
     class Meta:
         model = Recipe
@@ -253,35 +489,52 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             'image',
         )
 
-    def validate_tags(self, data):
-        tags = self.initial_data.get('tags')
-        list_tags = []
-        if not tags:
+    @staticmethod
+    def get_objects(model, ids, name):
+        """
+        Загружает объекты по списку id одним запросом IN.
+        Об отсутствующих и повторяющихся id сообщает сразу.
+        """
+
+        objects = model.objects.in_bulk(ids)
+        errors = []
+        duplicates = sorted(
+            pk for pk, count in Counter(ids).items() if count > 1
+        )
+        if duplicates:
+            errors.append(
+                f'{name} должен быть уникальным. Повторяются id: '
+                f'{", ".join(map(str, duplicates))}.'
+            )
+        missing = sorted(set(ids) - objects.keys())
+        if missing:
+            errors.append(
+                f'{name} не найден. Нет объектов с id: '
+                f'{", ".join(map(str, missing))}.'
+            )
+        if errors:
+            raise serializers.ValidationError(errors)
+        return [objects[pk] for pk in ids]
+
+    def validate_tags(self, value):
+        if not value:
             raise serializers.ValidationError(
                 'Хотя бы один тег должен быть.'
             )
-        for tag in list_tags:
-            if tag['id'] in list_tags:
-                raise serializers.ValidationError(
-                    'Тег должен быть уникальным.'
-                )
-            list_tags.append(tag['id'])
-        return data
+        return self.get_objects(Tag, value, 'Тег')
 
-    def validate_ingredients(self, data):
-        ingredients = self.initial_data.get('ingredients')
-        list_ingredients = []
-        if not ingredients:
+    def validate_ingredients(self, value):
+        if not value:
             raise serializers.ValidationError(
                 'Хотя бы один ингредиент должен быть.'
             )
-        for ingredient in list_ingredients:
-            if ingredient['id'] in list_ingredients:
-                raise serializers.ValidationError(
-                    'Ингредиент должен быть уникальным.'
-                )
-            list_ingredients.append(ingredient['id'])
-        return data
+        ingredients = self.get_objects(
+            Ingredient, [item['id'] for item in value], 'Ингредиент'
+        )
+        return [
+            {'ingredient': ingredient, 'amount': item['amount']}
+            for ingredient, item in zip(ingredients, value)
+        ]
 
     def validate_cooking_time(self, value):
         if not (
@@ -294,61 +547,131 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             )
         return value
 
+    @staticmethod
+    def set_tags(recipe, tags):
+        """
+        Приводит теги рецепта к переданным:
+        удаляет лишние связи и добавляет недостающие пачкой.
+        """
+
+        current = set(
+            RecipeTag.objects.filter(
+                recipe=recipe
+            ).values_list('tag_id', flat=True)
+        )
+        submitted = {tag.id for tag in tags}
+        if current - submitted:
+            RecipeTag.objects.filter(
+                recipe=recipe, tag_id__in=current - submitted
+            ).delete()
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe=recipe, tag_id=tag_id)
+            for tag_id in submitted - current
+        )
+
+    @staticmethod
+    def set_ingredients(recipe, ingredients):
+        """
+        Приводит ингредиенты рецепта к переданным.
+        Трогаем только изменившиеся строки: лишние удаляем,
+        новые добавляем, у оставшихся обновляем количество.
+        Списки покупок пересчитываются по изменившимся ингредиентам.
+        """
+
+        current = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in RecipeIngredient.objects.filter(
+                recipe=recipe
+            )
+        }
+        submitted = {
+            ingredient['ingredient'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
+        removed = current.keys() - submitted.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).delete()
+        changed = []
+        for ingredient_id, recipe_ingredient in current.items():
+            amount = submitted.get(ingredient_id)
+            if amount is not None and recipe_ingredient.amount != amount:
+                recipe_ingredient.amount = amount
+                changed.append(recipe_ingredient)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        added = submitted.keys() - current.keys()
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe, ingredient_id=ingredient_id,
+                amount=submitted[ingredient_id]
+            )
+            for ingredient_id in added
+        )
+        affected = removed | added | {
+            recipe_ingredient.ingredient_id for recipe_ingredient in changed
+        }
+        if affected:
+            ShoppingListItem.objects.refresh_for_recipe(recipe, affected)
+
+    @transaction.atomic
     def create(self, validated_data):
         """
         Создание рецепта.
-        Делаем, чтобы сделать связь m2m.
+        Связи m2m добавляем пачкой, всё в одной транзакции.
         """
 
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
-        for tag in tags:
-            RecipeTag.objects.create(recipe=recipe, tag=tag)
-        for ingredient in ingredients:
-            RecipeIngredient.objects.create(
-                ingredient=ingredient["ingredient"],
-                amount=ingredient["amount"],
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe=recipe, tag=tag) for tag in tags
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                ingredient=ingredient['ingredient'],
+                amount=ingredient['amount'],
                 recipe=recipe
             )
+            for ingredient in ingredients
+        )
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         """
         Изменение рецепта.
         Доступно только автору.
-        Делаем, чтобы сделать связь m2m.
+        Связи m2m меняем по разнице с сохранёнными,
+        всё в одной транзакции.
         """
 
-        RecipeTag.objects.filter(recipe=instance).delete()
-        RecipeIngredient.objects.filter(recipe=instance).delete()
-        ingredients = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
-        for tag in tags:
-            RecipeTag.objects.create(recipe=instance, tag=tag)
-        for ingredient in ingredients:
-            RecipeIngredient.objects.create(
-                ingredient=ingredient["ingredient"],
-                amount=ingredient["amount"],
-                recipe=instance
-            )
-        instance.name = validated_data.pop('name')
-        instance.text = validated_data.pop('text')
-        if validated_data.get('image'):
-            instance.image = validated_data.pop('image')
-        instance.cooking_time = validated_data.pop('cooking_time')
-        instance.save()
-        return instance
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
+        if tags is not None:
+            self.set_tags(instance, tags)
+        if ingredients is not None:
+            self.set_ingredients(instance, ingredients)
+        return super().update(instance, validated_data)
 
+    @measure('serializer')
     def to_representation(self, instance):
+        """
+        Ответ строим по той же аннотированной выборке,
+        что и при чтении рецептов.
+        """
+
+        instance = self.context['view'].get_queryset().get(pk=instance.pk)
         context = {"request": self.context.get("request")}
         return RecipesSerializer(instance, context=context).data
 
 
-class ShortRecipeSerializer(serializers.ModelSerializer):
+class ShortRecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для отображения списка покупок и избранного."""
 
-    image = Base64ImageField()
+    image = RecipeImageField(variant='card')
+    images = RecipeImagesField()
 
     class Meta:
         model = Recipe
@@ -356,5 +679,6 @@ class ShortRecipeSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'images',
             'cooking_time'
         )
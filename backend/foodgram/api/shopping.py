@@ -0,0 +1,173 @@
+import csv
+import hashlib
+import json
+import logging
+import os
+from datetime import timedelta
+from functools import lru_cache
+from time import perf_counter
+
+import weasyprint
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db.models import OuterRef, Subquery
+from django.template.loader import get_template, render_to_string
+from django.utils import timezone
+
+from recipes.models import Ingredient, ShoppingListItem, ShoppingListPDF
+
+logger = logging.getLogger(__name__)
+
+PDF_DIR = 'shopping_lists/'
+TEMPLATE = 'ingredients_buy.html'
+
+# Статусы PDF для get_or_render_pdf.
+PDF_READY = 'ready'
+PDF_PENDING = 'pending'
+PDF_FAILED = 'failed'
+
+# Списки покупок не лежат в публичном MEDIA_ROOT, их отдаёт только
+# download_shopping. Старые файлы удаляет clear_shopping_lists.
+pdf_storage = FileSystemStorage(location=getattr(
+    settings, 'SHOPPING_LIST_ROOT',
+    os.path.join(settings.BASE_DIR, 'private')
+))
+
+
+def get_ingredients_queryset(user):
+    """
+    Суммарный список ингредиентов из корзины пользователя.
+    Читается из готового агрегата ShoppingListItem. Название и
+    единица измерения берутся подзапросами по первичному ключу
+    ингредиента: с JOIN планировщик читает весь справочник.
+    """
+
+    ingredient = Ingredient.objects.filter(pk=OuterRef('ingredient'))
+    return ShoppingListItem.objects.filter(user=user).values(
+        'amount',
+        ingredient__name=Subquery(ingredient.values('name')),
+        ingredient__measurement_unit=Subquery(
+            ingredient.values('measurement_unit')
+        )
+    ).order_by('ingredient__name', 'ingredient__measurement_unit')
+
+
+def get_ingredients(user):
+    return list(get_ingredients_queryset(user))
+
+
+class Echo:
+    """Псевдо-файл для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def stream_txt(ingredients):
+    for ingredient in ingredients:
+        yield (
+            f"{ingredient['ingredient__name']} : {ingredient['amount']} "
+            f"{ingredient['ingredient__measurement_unit']}\n"
+        )
+
+
+def stream_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'amount', 'measurement_unit'))
+    for ingredient in ingredients:
+        yield writer.writerow((
+            ingredient['ingredient__name'],
+            ingredient['amount'],
+            ingredient['ingredient__measurement_unit']
+        ))
+
+
+def stream_json(ingredients):
+    yield '['
+    separator = ''
+    for ingredient in ingredients:
+        yield separator + json.dumps({
+            'name': ingredient['ingredient__name'],
+            'amount': ingredient['amount'],
+            'measurement_unit': ingredient['ingredient__measurement_unit']
+        }, ensure_ascii=False)
+        separator = ','
+    yield ']'
+
+
+# Лёгкие форматы: строки отдаются прямо из курсора, без шаблона.
+STREAM_FORMATS = {
+    'txt': stream_txt,
+    'csv': stream_csv,
+    'json': stream_json,
+}
+
+
+@lru_cache(maxsize=None)
+def get_template_version():
+    """Хэш исходника шаблона: новый шаблон - новые имена PDF."""
+
+    source = get_template(TEMPLATE).template.source
+    return hashlib.sha256(source.encode()).hexdigest()[:12]
+
+
+def get_pdf_name(ingredients):
+    """
+    Имя PDF в хранилище - хэш версии шаблона и содержимого
+    списка покупок.
+    """
+
+    content = json.dumps(
+        [get_template_version(), ingredients],
+        ensure_ascii=False, sort_keys=True
+    )
+    digest = hashlib.sha256(content.encode()).hexdigest()
+    return f'{PDF_DIR}{digest}.pdf'
+
+
+def render_pdf(ingredients, name):
+    """
+    Рендерит список покупок и сохраняет PDF под именем name.
+    Возвращает время рендера в мс. Вызывается только из
+    render_shopping_lists, ошибки обрабатывает вызывающий.
+    """
+
+    start = perf_counter()
+    html = render_to_string(TEMPLATE, {'ingredients': ingredients})
+    pdf = weasyprint.HTML(string=html).write_pdf()
+    if not pdf_storage.exists(name):
+        saved_name = pdf_storage.save(name, ContentFile(pdf))
+        # Тот же файл мог сохранить другой воркер.
+        if saved_name != name:
+            pdf_storage.delete(saved_name)
+    return (perf_counter() - start) * 1000
+
+
+def get_or_render_pdf(ingredients):
+    """
+    Имя PDF в хранилище pdf_storage и статус: PDF_READY - файл готов,
+    PDF_PENDING - задача ShoppingListPDF ждёт render_shopping_lists
+    (одна на один и тот же список во всех процессах), PDF_FAILED -
+    рендер не удался SHOPPING_LIST_RENDER_ATTEMPTS раз подряд.
+    Через SHOPPING_LIST_FAILURE_TIMEOUT секунд после последней
+    неудачи рендер пробуется снова.
+    """
+
+    name = get_pdf_name(ingredients)
+    if pdf_storage.exists(name):
+        return name, PDF_READY
+    task, _ = ShoppingListPDF.objects.get_or_create(
+        name=name, defaults={'ingredients': ingredients}
+    )
+    if task.attempts < getattr(settings, 'SHOPPING_LIST_RENDER_ATTEMPTS', 3):
+        return name, PDF_PENDING
+    retry_after = task.updated + timedelta(
+        seconds=getattr(settings, 'SHOPPING_LIST_FAILURE_TIMEOUT', 600)
+    )
+    if retry_after > timezone.now():
+        return name, PDF_FAILED
+    ShoppingListPDF.objects.filter(
+        name=name, updated=task.updated
+    ).update(attempts=0, updated=timezone.now())
+    return name, PDF_PENDING
@@ -0,0 +1,71 @@
+from rest_framework.exceptions import ValidationError
+
+FIELDS_PARAM = 'fields'
+OMIT_PARAM = 'omit'
+
+
+def get_names(query_params, param):
+    """Имена из параметра param: через запятую и/или повтором."""
+
+    return [
+        name.strip()
+        for value in query_params.getlist(param)
+        for name in value.split(',')
+        if name.strip()
+    ]
+
+
+def select_fields(query_params, available):
+    """
+    Поля ответа из available по параметрам fields= и omit=,
+    в порядке available. None - параметров нет, нужны все поля.
+    """
+
+    fields = get_names(query_params, FIELDS_PARAM)
+    omit = get_names(query_params, OMIT_PARAM)
+    if not fields and not omit:
+        return None
+    errors = {}
+    for param, names in ((FIELDS_PARAM, fields), (OMIT_PARAM, omit)):
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            errors[param] = [f'Неизвестные поля: {", ".join(unknown)}.']
+    if errors:
+        raise ValidationError(errors)
+    return tuple(
+        name for name in available
+        if (not fields or name in fields) and name not in omit
+    )
+
+
+class SparseFieldsMixin:
+    """
+    Параметры fields= и omit= сокращают ответ GET-действий
+    sparse_actions до нужных полей. Сериализатор получает их
+    аргументом fields, а get_queryset() по get_sparse_fields()
+    не загружает то, что выводиться не будет.
+    """
+
+    sparse_actions = ('list', 'retrieve')
+
+    def get_sparse_fields(self, serializer_class=None):
+        """
+        Выбранные поля сериализатора (по умолчанию - вьюхи);
+        None - выводятся все.
+        """
+
+        if (
+            self.action not in self.sparse_actions
+            or self.request.method != 'GET'
+        ):
+            return None
+        serializer_class = serializer_class or self.get_serializer_class()
+        return select_fields(
+            self.request.query_params, serializer_class.Meta.fields
+        )
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_sparse_fields()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)
@@ -0,0 +1,112 @@
+import json
+
+from django.contrib.auth.models import AnonymousUser
+from django.test import TestCase
+from rest_framework.test import APIRequestFactory
+
+from api.serializers import RecipeReadSerializer, RecipesSerializer
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            RecipeTag, ShoppingCart, Tag)
+from users.models import CustomUser, Subscription
+
+IMAGE = 'recipes/images/test.png'
+
+
+class RecipeReadSerializerTest(TestCase):
+    """
+    RecipeReadSerializer отдаёт тот же JSON, что и RecipesSerializer,
+    в списке и в карточке рецепта, анониму и пользователю.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.user = (
+            CustomUser.objects.create_user(
+                username=name, email=f'{name}@example.com',
+                password='password', first_name=name, last_name=name
+            )
+            for name in ('author', 'reader')
+        )
+        Subscription.objects.create(user=cls.user, author=cls.author)
+        tags = Tag.objects.bulk_create(
+            Tag(name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag{number}')
+            for number in range(3)
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(4)
+        )
+        # bulk_create без сигналов: копии изображений не строятся.
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=author, name=f'Рецепт {number}',
+                text=f'Текст {number}', cooking_time=number + 5,
+                image=IMAGE,
+                image_derivatives=(
+                    {'source': IMAGE, 'card': 'recipes/images/card.jpg'}
+                    if number % 2 else {}
+                )
+            )
+            for number, author in enumerate(
+                (cls.author, cls.author, cls.user, cls.author)
+            )
+        )
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe=recipe, tag=tag)
+            for number, recipe in enumerate(recipes)
+            for tag in tags[:number % 3 + 1]
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                             amount=number + 1)
+            for number, recipe in enumerate(recipes)
+            for ingredient in ingredients[number % 2:]
+        )
+        Favorite.objects.create(user=cls.user, recipe=recipes[0])
+        ShoppingCart.objects.create(user=cls.user, recipe=recipes[1])
+
+    def get_context(self, user, variant):
+        request = APIRequestFactory().get('/api/recipes/')
+        request.user = user
+        return {'request': request, 'image_variant': variant}
+
+    def serialize(self, serializer_class, instance, context, many):
+        return json.loads(json.dumps(
+            serializer_class(instance, many=many, context=context).data
+        ))
+
+    def assert_same(self, user, variant, many):
+        recipes = Recipe.objects.order_by('-pub_date', '-id')
+        rows = recipes.with_user_flags(user).values(
+            *RecipeReadSerializer.get_row_fields()
+        )
+        objects = recipes.with_relations(user)
+        if not many:
+            rows, objects = rows.first(), objects.first()
+        context = self.get_context(user, variant)
+        fast = self.serialize(RecipeReadSerializer, rows, context, many)
+        self.assertEqual(
+            fast, self.serialize(RecipesSerializer, objects, context, many)
+        )
+        return fast
+
+    def test_list(self):
+        for user in (AnonymousUser(), self.user):
+            with self.subTest(user=str(user)):
+                data = self.assert_same(user, 'card', many=True)
+                self.assertEqual(len(data), Recipe.objects.count())
+
+    def test_detail(self):
+        for user in (AnonymousUser(), self.user):
+            with self.subTest(user=str(user)):
+                self.assert_same(user, 'detail', many=False)
+
+    def test_user_flags(self):
+        data = self.assert_same(self.user, 'card', many=True)
+        self.assertEqual(
+            [(recipe['is_favorited'], recipe['is_in_shopping_cart'],
+              recipe['author']['is_subscribed']) for recipe in data],
+            [(False, False, True), (False, False, False),
+             (False, True, True), (True, False, True)]
+        )
@@ -0,0 +1,83 @@
+from uuid import uuid4
+
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler
+from PIL import Image
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.status import HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+from core.parametrs import Parameters
+from recipes.images import IMAGE_ERRORS
+
+MAX_SIZE = Parameters.MAX_IMAGE_UPLOAD_MB.value * 1024 * 1024
+TOKEN_MAX_AGE = Parameters.UPLOAD_TOKEN_MAX_AGE_HOURS.value * 60 * 60
+TOKEN_SALT = 'api.uploads'
+UPLOAD_DIR = 'recipes/images/'
+# Форматы, которые принимаются, и расширения файлов для них.
+FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+
+class ImageTooLarge(APIException):
+    status_code = HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = (
+        f'Файл больше {Parameters.MAX_IMAGE_UPLOAD_MB.value} МБ.'
+    )
+    default_code = 'too_large'
+
+
+class MaxSizeUploadHandler(FileUploadHandler):
+    """
+    Обрывает загрузку, как только пришло больше MAX_SIZE байт,
+    в том числе когда размер заранее не известен (chunked).
+    """
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > MAX_SIZE:
+            raise ImageTooLarge
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+def save_upload(file):
+    """
+    Проверяет, что file - изображение допустимого формата,
+    и сохраняет его в хранилище. Возвращает имя файла.
+    """
+
+    if file.size > MAX_SIZE:
+        raise ImageTooLarge
+    try:
+        with Image.open(file) as image:
+            image_format = image.format
+            image.verify()
+    except IMAGE_ERRORS:
+        raise ValidationError({'image': ['Файл не является изображением.']})
+    if image_format not in FORMATS:
+        raise ValidationError(
+            {'image': [f'Допустимые форматы: {", ".join(FORMATS)}.']}
+        )
+    file.seek(0)
+    return default_storage.save(
+        f'{UPLOAD_DIR}{uuid4()}.{FORMATS[image_format]}', file
+    )
+
+
+def make_token(name, user):
+    return signing.dumps({'name': name, 'user': user.pk}, salt=TOKEN_SALT)
+
+
+def read_token(token, user):
+    """Имя загруженного файла по токену или None, если это не токен."""
+
+    try:
+        data = signing.loads(token, salt=TOKEN_SALT, max_age=TOKEN_MAX_AGE)
+    except signing.SignatureExpired:
+        raise ValidationError('Срок действия токена загрузки истёк.')
+    except signing.BadSignature:
+        return None
+    if data['user'] != user.pk:
+        raise ValidationError('Изображение загружено другим пользователем.')
+    return data['name']
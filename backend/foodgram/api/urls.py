@@ -4,7 +4,7 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     TagViewSet, RecipeViewSet,
     CustomUserViewSet, IngredientViewSet,
-    download_shopping
+    download_shopping, upload_image
 )
 
 app_name = 'api'
@@ -21,6 +21,7 @@ urlpatterns = [
         download_shopping,
         name='download_shopping'
     ),
+    path('uploads/', upload_image, name='upload_image'),
     path('auth/', include('djoser.urls.authtoken')),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
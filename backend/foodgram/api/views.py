@@ -1,40 +1,119 @@
-import weasyprint
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
+from django.http import FileResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.template.loader import render_to_string
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from rest_framework.decorators import action, api_view
-from rest_framework.filters import SearchFilter
+from rest_framework.decorators import (action, api_view, parser_classes,
+                                       permission_classes, renderer_classes)
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import (
     IsAuthenticated,
     AllowAny
 )
 from rest_framework.response import Response
-from rest_framework.status import (HTTP_201_CREATED,
+from rest_framework.status import (HTTP_201_CREATED, HTTP_202_ACCEPTED,
                                    HTTP_400_BAD_REQUEST,
-                                   HTTP_204_NO_CONTENT)
+                                   HTTP_204_NO_CONTENT,
+                                   HTTP_500_INTERNAL_SERVER_ERROR)
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from recipes.models import (Tag, Recipe, Ingredient,
+from core.parametrs import Parameters
+from core.timing import measure
+from core.versions import (INGREDIENTS_VERSION, RECIPE_VERSION,
+                           RECIPES_VERSION, TAGS_VERSION,
+                           get_version, version_datetime)
+from recipes.models import (USER_FLAGS, Tag, Recipe, Ingredient,
                             Favorite, ShoppingCart,
-                            RecipeIngredient)
+                            RecipeIngredient, ShoppingListItem)
+from recipes.search import ingredient_index
 from users.models import CustomUser
 from users.models import Subscription
+from .cache import AnonymousCacheMixin
 from .filters import RecipeFilter
 from .pagination import CustomPagination
+from .parsers import ImageUploadParser
 from .permissions import IsAuthorOrAdminOrReadOnly
+from .renderers import (PDFRenderer, PlainTextRenderer,
+                        CSVRenderer, ShoppingListJSONRenderer)
 from .serializers import (TagSerializer, RecipesSerializer,
                           RecipeCreateSerializer, IngredientSerializer,
                           SubscriptionSerializer, ShowSubscriptionSerializer,
-                          CustomUserSerializer, ShortRecipeSerializer)
+                          CustomUserSerializer, ShortRecipeSerializer,
+                          RecipeReadSerializer, RecipeIdsSerializer)
+from .shopping import (PDF_FAILED, PDF_READY, STREAM_FORMATS, get_ingredients,
+                       get_ingredients_queryset, get_or_render_pdf,
+                       pdf_storage)
+from .sparse import SparseFieldsMixin
+from .uploads import MaxSizeUploadHandler, make_token, save_upload
 
 
-class CustomUserViewSet(UserViewSet):
+class CustomUserViewSet(SparseFieldsMixin, UserViewSet):
     serializer_class = CustomUserSerializer
     pagination_class = CustomPagination
+    # Порядок для keyset-пагинации (?cursor=).
+    cursor_ordering = ('username', 'id')
     permission_classes = (IsAuthorOrAdminOrReadOnly,)
+    sparse_actions = ('list', 'retrieve', 'me', 'subscriptions')
+
+    def get_queryset(self):
+        """
+        Статус подписки считается для всей выборки одним подзапросом,
+        если он есть среди запрошенных полей.
+        """
+
+        queryset = super().get_queryset()
+        fields = self.get_sparse_fields()
+        if fields is not None and 'is_subscribed' not in fields:
+            return queryset
+        return queryset.with_subscription(self.request.user)
+
+    def get_recipes_limit(self):
+        """
+        Сколько последних рецептов автора показывать в подписках.
+        Не больше MAX_RECIPES_LIMIT, даже если параметр не передан.
+        """
+
+        max_limit = Parameters.MAX_RECIPES_LIMIT.value
+        recipes_limit = self.request.query_params.get('recipes_limit')
+        if recipes_limit is None:
+            return max_limit
+        try:
+            recipes_limit = int(recipes_limit)
+        except ValueError:
+            recipes_limit = 0
+        if recipes_limit < 1:
+            raise ValidationError(
+                {'recipes_limit': 'Должно быть положительным числом.'}
+            )
+        return min(recipes_limit, max_limit)
+
+    def with_subscription_info(self, queryset, fields=None):
+        """
+        Готовит авторов для ShowSubscriptionSerializer:
+        статус подписки - аннотацией, последние recipes_limit
+        рецептов каждого автора - одним оконным запросом на всю страницу.
+        Если задан fields, готовится только то, что в нём есть.
+        """
+
+        if fields is None or 'is_subscribed' in fields:
+            queryset = queryset.with_subscription(self.request.user)
+        if fields is not None and 'recipes' not in fields:
+            return queryset
+        recent_recipes = Recipe.objects.order_by(
+            '-pub_date'
+        )[:self.get_recipes_limit()]
+        return queryset.prefetch_related(
+            Prefetch(
+                'user_recipes',
+                queryset=recent_recipes,
+                to_attr='recent_recipes'
+            )
+        )
 
     @action(
         detail=True,
@@ -52,18 +131,30 @@ class CustomUserViewSet(UserViewSet):
                 context={'request': request}
             )
             if serializer.is_valid(raise_exception=True):
-                serializer.save()
+                # Повтор или параллельный запрос упирается
+                # в уникальность подписки - это 400, а не 500.
+                try:
+                    with transaction.atomic():
+                        serializer.save()
+                except IntegrityError:
+                    raise ValidationError(
+                        {'non_field_errors': ['Вы уже подписаны!']}
+                    )
+                author = self.with_subscription_info(
+                    CustomUser.objects.all()
+                ).get(pk=id)
                 return Response(
-                    serializer.data, status=HTTP_201_CREATED)
+                    ShowSubscriptionSerializer(
+                        author, context={'request': request}
+                    ).data,
+                    status=HTTP_201_CREATED
+                )
             return Response(status=HTTP_400_BAD_REQUEST)
         author = get_object_or_404(CustomUser, id=id)
-        if Subscription.objects.filter(
-                user=request.user,
-                author=author).exists():
-            subscription = get_object_or_404(
-                Subscription, user=request.user, author=author
-            )
-            subscription.delete()
+        deleted, _ = Subscription.objects.filter(
+            user=request.user, author=author
+        ).delete()
+        if deleted:
             return Response(status=HTTP_204_NO_CONTENT)
         return Response(status=HTTP_400_BAD_REQUEST)
 
@@ -77,17 +168,44 @@ class CustomUserViewSet(UserViewSet):
         """
         Получить пользователей на которых подписан текущий пользователь.
         """
-        subscription = CustomUser.objects.filter(author__user=request.user)
+        fields = self.get_sparse_fields(ShowSubscriptionSerializer)
+        subscription = self.with_subscription_info(
+            CustomUser.objects.filter(author__user=request.user), fields
+        )
         page = self.paginate_queryset(subscription)
         serializer = ShowSubscriptionSerializer(
             page,
             many=True,
-            context={'request': request}
+            context={'request': request},
+            fields=fields
         )
 
         return self.get_paginated_response(serializer.data)
 
 
+def catalogue_condition(name):
+    """
+    Условный GET для справочника: версия набора данных name
+    отдаётся как ETag и Last-Modified. При совпадении If-None-Match
+    сразу возвращается 304 - без запросов к таблице и сериализации.
+    ETag слабый: одна версия данных отдаётся в разных представлениях
+    (?fields=, ?format=), побайтно они не совпадают.
+    """
+
+    return method_decorator(
+        condition(
+            etag_func=lambda request, *args, **kwargs: (
+                f'W/"{get_version(name)}"'
+            ),
+            last_modified_func=lambda request, *args, **kwargs: (
+                version_datetime(get_version(name))
+            )
+        ),
+        name='dispatch'
+    )
+
+
+@catalogue_condition(TAGS_VERSION)
 class TagViewSet(ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
@@ -95,37 +213,107 @@ class TagViewSet(ReadOnlyModelViewSet):
     permission_classes = (AllowAny,)
 
 
+@catalogue_condition(INGREDIENTS_VERSION)
 class IngredientViewSet(ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
     permission_classes = (AllowAny,)
-    filter_backends = (SearchFilter,)
-    search_fields = ('^name',)
+
+    def list(self, request, *args, **kwargs):
+        """
+        Автодополнение по началу названия.
+        Отвечает индекс в памяти, без запросов к ингредиентам в бд.
+        """
+
+        name = request.query_params.get(
+            'name', request.query_params.get('search', '')
+        )
+        return Response(ingredient_index.search(name))
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(AnonymousCacheMixin, SparseFieldsMixin,
+                    ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipesSerializer
     permission_classes = (IsAuthorOrAdminOrReadOnly,)
+    pagination_class = CustomPagination
+    # Порядок списка: и страниц, и keyset-пагинации (?cursor=).
+    cursor_ordering = ('pub_date', 'id')
+    # Действия, которые читают рецепты строками RecipeReadSerializer.
+    sparse_actions = ('list', 'retrieve', 'feed')
+    # Нечисловой id - сразу 404, до запросов к бд.
+    lookup_value_regex = r'\d+'
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
     def get_queryset(self):
         """
         Для оптимизации запросов к бд.
+        Список и просмотр рецепта читаются строками values()
+        только с колонками нужных полей, остальное - объектами
+        со связями, загруженными для всей выборки сразу.
+        """
+
+        user = self.request.user
+        if self.action in self.sparse_actions:
+            # С fields=/omit= выбираются только нужные колонки и флаги.
+            row_fields = RecipeReadSerializer.get_row_fields(
+                self.get_sparse_fields()
+            )
+            recipes = Recipe.objects.all()
+            if self.action == 'feed':
+                recipes = recipes.feed(user)
+                row_fields += ('feed_pub_date',)
+            return recipes.with_user_flags(user, [
+                flag for flag in USER_FLAGS if flag in row_fields
+            ]).values(*row_fields)
+        return Recipe.objects.with_relations(user)
+
+    def get_cache_versions(self):
+        """
+        Списки зависят от всех рецептов, рецепт - только от себя.
+        Теги и ингредиенты выводятся в обоих.
+        """
+
+        if self.action == 'list':
+            return RECIPES_VERSION, TAGS_VERSION, INGREDIENTS_VERSION
+        return (
+            RECIPE_VERSION.format(self.kwargs['pk']),
+            TAGS_VERSION, INGREDIENTS_VERSION
+        )
+
+    def get_count_versions(self):
+        """
+        Версии для кэша числа рецептов в списке. None - не кэшировать:
+        у избранного и корзины пользователя версий нет.
         """
 
-        recipes = Recipe.objects.prefetch_related(
-            'recipe_ingredients__ingredient', 'recipe_tags__tag'
-        ).all()
-        return recipes
+        if self.request.user.is_authenticated and any(
+            name in self.request.query_params
+            for name in RecipeFilter.user_filters
+        ):
+            return None
+        return self.get_cache_versions()
+
+    def get_serializer_context(self):
+        """
+        В списке рецептов и ленте изображения отдаются
+        в размере карточки.
+        """
+
+        context = super().get_serializer_context()
+        if self.action in ('list', 'feed'):
+            context['image_variant'] = 'card'
+        return context
 
     def get_serializer_class(self):
         """
         Под каждый тип запросов свой serializer.
         """
 
+        if self.action in self.sparse_actions:
+            return RecipeReadSerializer
         if self.request.method == 'GET':
             return RecipesSerializer
         return RecipeCreateSerializer
@@ -133,27 +321,80 @@ class RecipeViewSet(ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        """Удалённый рецепт уходит и из списков покупок."""
+
+        users = list(instance.shopping_cart.values_list('user', flat=True))
+        ingredients = list(
+            instance.recipe_ingredients.values_list('ingredient', flat=True)
+        )
+        instance.delete()
+        if users:
+            ShoppingListItem.objects.refresh(users, ingredients)
+
     def add_to_model(self, model, user, pk):
-        if not model.objects.filter(
-                user=user, recipe__id=pk
-        ).exists():
-            recipe = get_object_or_404(Recipe, id=pk)
-            model.objects.create(recipe=recipe, user=user)
-            serializer = ShortRecipeSerializer(recipe)
+        """
+        Добавление одним запросом: повтор или параллельный запрос
+        получает 400 по числу вставленных строк, а не ошибку БД.
+        """
+
+        if model.objects.add(user, (int(pk),)):
+            serializer = ShortRecipeSerializer(
+                get_object_or_404(Recipe, id=pk)
+            )
             return Response(serializer.data, status=HTTP_201_CREATED)
+        get_object_or_404(Recipe, id=pk)
         return Response(status=HTTP_400_BAD_REQUEST)
 
     def delete_from_model(self, model, user, pk):
-        if model.objects.filter(
-                user=user,
-                recipe__id=pk).exists():
-            model.objects.filter(
-                user=user,
-                recipe__id=pk
-            ).delete()
+        if model.objects.remove(user, (int(pk),)):
             return Response(status=HTTP_204_NO_CONTENT)
         return Response(status=HTTP_400_BAD_REQUEST)
 
+    def change_in_bulk(self, model, request):
+        """
+        Добавляет или убирает сразу много рецептов
+        ({"recipes": [id, ...]}) одним запросом. В ответе - id
+        рецептов, которые действительно добавились или удалились.
+        """
+
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipes = serializer.validated_data['recipes']
+        if request.method == 'POST':
+            return Response(
+                {'added': model.objects.add(request.user, recipes)},
+                status=HTTP_201_CREATED
+            )
+        return Response(
+            {'removed': model.objects.remove(request.user, recipes)}
+        )
+
+    def refresh_shopping_list(self, user, recipes):
+        ShoppingListItem.objects.refresh(
+            (user.pk,),
+            RecipeIngredient.objects.filter(
+                recipe__in=recipes
+            ).values('ingredient')
+        )
+
+    @action(detail=False, permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        """
+        Лента: рецепты авторов, на которых подписан пользователь,
+        от новых к старым. Пагинация только курсором (?cursor=),
+        поэтому страница не зависит от числа подписок и рецептов.
+        """
+
+        self.cursor_ordering = ('-feed_pub_date', '-id')
+        self.cursor_only = True
+        page = self.paginate_queryset(
+            self.filter_queryset(self.get_queryset())
+        )
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     @action(
         detail=True,
         methods=['post', 'delete'],
@@ -165,29 +406,116 @@ class RecipeViewSet(ModelViewSet):
         else:
             return self.delete_from_model(Favorite, request.user, pk)
 
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='favorite',
+        url_name='favorite-bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    def favorite_bulk(self, request):
+        return self.change_in_bulk(Favorite, request)
+
     @action(
         detail=True,
         methods=['post', 'delete'],
         permission_classes=(IsAuthenticated,)
     )
+    @transaction.atomic
     def shopping_cart(self, request, pk):
         if request.method == 'POST':
-            return self.add_to_model(ShoppingCart, request.user, pk)
-        return self.delete_from_model(ShoppingCart, request.user, pk)
+            response = self.add_to_model(ShoppingCart, request.user, pk)
+        else:
+            response = self.delete_from_model(ShoppingCart, request.user, pk)
+        if response.status_code in (HTTP_201_CREATED, HTTP_204_NO_CONTENT):
+            self.refresh_shopping_list(request.user, (pk,))
+        return response
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart',
+        url_name='shopping_cart-bulk',
+        permission_classes=(IsAuthenticated,)
+    )
+    @transaction.atomic
+    def shopping_cart_bulk(self, request):
+        response = self.change_in_bulk(ShoppingCart, request)
+        recipes = response.data.get('added', response.data.get('removed'))
+        if recipes:
+            self.refresh_shopping_list(request.user, recipes)
+        return response
 
 
 @api_view(['GET'])
+@permission_classes((IsAuthenticated,))
+@renderer_classes((PDFRenderer, PlainTextRenderer,
+                   CSVRenderer, ShoppingListJSONRenderer))
 def download_shopping(request):
-    ingredients = RecipeIngredient.objects.filter(
-        recipe__shopping_cart__user=request.user
-    ).values('ingredient__name', 'ingredient__measurement_unit', ).annotate(
-        amount=Sum('amount')
+    """
+    Список покупок в формате pdf (по умолчанию), txt, csv или json.
+    Формат выбирается параметром format или заголовком Accept.
+    txt, csv и json отдаются потоком прямо из запроса к бд.
+    PDF берётся из закрытого хранилища по хэшу списка. Если его ещё
+    нет, рендер уходит в фон, а клиент получает 202 и адрес для
+    повтора; если рендер не удался несколько раз подряд - 500.
+    """
+
+    renderer = request.accepted_renderer
+    if renderer.format in STREAM_FORMATS:
+        response = StreamingHttpResponse(
+            STREAM_FORMATS[renderer.format](
+                get_ingredients_queryset(request.user).iterator()
+            ),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        response['Content-Disposition'] = (
+            f'filename=wish_list.{renderer.format}'
+        )
+        return response
+    # Здесь только поиск файла и постановка задачи, время рендера
+    # пишет в лог render_shopping_lists.
+    with measure('pdf_lookup'):
+        name, status = get_or_render_pdf(get_ingredients(request.user))
+    if status == PDF_FAILED:
+        return JsonResponse(
+            {'status': status}, status=HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    if status != PDF_READY:
+        response = JsonResponse(
+            {'status': status, 'url': request.build_absolute_uri()},
+            status=HTTP_202_ACCEPTED
+        )
+        response['Retry-After'] = '1'
+        return response
+    response = FileResponse(
+        pdf_storage.open(name), content_type='application/pdf'
     )
-    # Передаем значение в pdf.
-    html = render_to_string('ingredients_buy.html',
-                            {'ingredients': ingredients})
-    # Указываем тип содержимого.
-    response = HttpResponse(content_type='application/pdf')
     response['Content-Disposition'] = 'filename=wish_list.pdf'
-    weasyprint.HTML(string=html).write_pdf(response)
     return response
+
+
+@api_view(('POST',))
+@permission_classes((IsAuthenticated,))
+@parser_classes((MultiPartParser, ImageUploadParser))
+def upload_image(request):
+    """
+    Загрузка изображения рецепта отдельным запросом: multipart
+    (поле image) или сам файл в теле с Content-Type image/*.
+    Файл пишется на диск частями, без base64 и JSON, в ответе -
+    токен, который передаётся в поле image рецепта.
+    """
+
+    # Обработчик должен встать первым, до разбора тела запроса.
+    request.upload_handlers.insert(0, MaxSizeUploadHandler(request))
+    file = request.FILES.get('image') or request.FILES.get('file')
+    if file is None:
+        raise ValidationError({'image': ['Файл не передан.']})
+    name = save_upload(file)
+    return Response(
+        {
+            'token': make_token(name, request.user),
+            'image': request.build_absolute_uri(default_storage.url(name))
+        },
+        status=HTTP_201_CREATED
+    )
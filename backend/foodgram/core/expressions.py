@@ -0,0 +1,22 @@
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_related(model, relation):
+    """
+    Коррелированный подзапрос: число объектов обратной связи relation
+    у строки внешнего запроса к model. Считается по таблице связи,
+    годится и для annotate, и для update.
+    """
+
+    field = model._meta.get_field(relation).field
+    return Coalesce(
+        Subquery(
+            field.model._default_manager.filter(
+                **{field.name: OuterRef('pk')}
+            ).order_by().values(field.name).annotate(
+                count=Count('pk')
+            ).values('count')
+        ),
+        0
+    )
@@ -0,0 +1,75 @@
+import json
+import logging
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connection
+
+from .timing import RequestTiming, current_timing, elapsed_ms, measure
+
+logger = logging.getLogger('core.timing')
+
+
+class ServerTimingMiddleware:
+    """
+    Замеры запросов к API: число SQL запросов, время БД, view,
+    сериализаторов и PDF. Отдаются заголовком Server-Timing
+    и строкой лога. Если запрос дольше SERVER_TIMING_SLOW_MS,
+    в лог пишется весь его SQL - так ищутся N+1 в живом трафике.
+
+    Должен стоять последним в MIDDLEWARE, тогда время view -
+    это время самого view. SQL, выполненный при отдаче
+    StreamingHttpResponse, в замеры не попадает.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = getattr(settings, 'SERVER_TIMING_PREFIX', '/api/')
+        self.slow_ms = getattr(settings, 'SERVER_TIMING_SLOW_MS', 500)
+
+    def __call__(self, request):
+        if not request.path.startswith(self.prefix):
+            return self.get_response(request)
+        timing = RequestTiming()
+        token = current_timing.set(timing)
+        start = perf_counter()
+        try:
+            with connection.execute_wrapper(timing):
+                with measure('view'):
+                    response = self.get_response(request)
+        finally:
+            current_timing.reset(token)
+        total_ms = elapsed_ms(start)
+        response['Server-Timing'] = self.get_header(timing)
+        self.log(request, response, timing, total_ms)
+        return response
+
+    def get_header(self, timing):
+        metrics = [
+            f'db;desc="{len(timing.queries)} queries";dur={timing.db_ms:.1f}'
+        ]
+        metrics.extend(
+            f'{name};dur={duration:.1f}'
+            for name, duration in timing.spans.items()
+        )
+        return ', '.join(metrics)
+
+    def log(self, request, response, timing, total_ms):
+        record = {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'queries': len(timing.queries),
+            'db_ms': round(timing.db_ms, 1),
+            'total_ms': round(total_ms, 1),
+        }
+        for name, duration in timing.spans.items():
+            record[f'{name}_ms'] = round(duration, 1)
+        if self.slow_ms is None or total_ms < self.slow_ms:
+            logger.info(json.dumps(record, ensure_ascii=False))
+            return
+        record['sql'] = [
+            {'ms': round(duration, 1), 'sql': sql}
+            for duration, sql in timing.queries
+        ]
+        logger.warning(json.dumps(record, ensure_ascii=False))
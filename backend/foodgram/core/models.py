@@ -0,0 +1,50 @@
+from django.db import models
+
+
+class CountersModelMixin:
+    """
+    Поля counter_fields меняются только F-выражениями, поэтому
+    сохранение существующего объекта без update_fields (формы админки,
+    ModelSerializer.update) пишет все поля, кроме них: иначе устаревшее
+    значение из памяти затёрло бы накопленный счётчик.
+    """
+
+    counter_fields = ()
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        if (
+            update_fields is None
+            and not force_insert
+            and not self._state.adding
+        ):
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+                and field.attname not in deferred
+            ]
+        super().save(force_insert, force_update, using, update_fields)
+
+
+class DataVersion(models.Model):
+    """
+    Версия набора данных (core.versions). Хранится в базе, чтобы
+    изменения из команд (import_ingredients, generate_dataset) видели
+    все процессы, а не только локальный кэш того, кто их сделал.
+    """
+
+    name = models.CharField(
+        verbose_name='Набор данных',
+        max_length=64,
+        primary_key=True
+    )
+    version = models.BigIntegerField(verbose_name='Версия')
+
+    class Meta:
+        verbose_name = 'Версия данных'
+        verbose_name_plural = 'Версии данных'
+
+    def __str__(self):
+        return f'{self.name}: {self.version}'
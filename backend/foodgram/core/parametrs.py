@@ -10,3 +10,17 @@ class Parameters(IntEnum):
     MAX_LEN_INT_COLOR = 7
     VALIDATE_COOKING_TIME_MIN = 1
     VALIDATE_COOKING_TIME_MAX = 120
+    # В приложении api.views:
+    MAX_RECIPES_LIMIT = 100
+    MAX_BULK_RECIPES = 500
+    # В приложении api.pagination:
+    MAX_PAGE_SIZE = 60
+    # В приложении recipes.search:
+    INGREDIENTS_SEARCH_LIMIT = 20
+    # В приложении recipes.images:
+    IMAGE_CARD_SIZE = 480
+    IMAGE_DETAIL_SIZE = 1200
+    IMAGE_QUALITY = 80
+    # В приложении api.uploads:
+    MAX_IMAGE_UPLOAD_MB = 10
+    UPLOAD_TOKEN_MAX_AGE_HOURS = 24
@@ -0,0 +1,59 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+# Замеры текущего запроса; None, если замеры выключены.
+current_timing = ContextVar('current_timing', default=None)
+
+
+def elapsed_ms(start):
+    return (perf_counter() - start) * 1000
+
+
+class RequestTiming:
+    """
+    Замеры одного запроса: число и время SQL запросов
+    и суммарное время именованных участков кода.
+    Подключается к соединению через connection.execute_wrapper().
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.spans = {}
+        self.active = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((elapsed_ms(start), sql))
+
+    @property
+    def db_ms(self):
+        return sum(duration for duration, sql in self.queries)
+
+    def add(self, name, duration):
+        self.spans[name] = self.spans.get(name, 0) + duration
+
+
+@contextmanager
+def measure(name):
+    """
+    Добавляет время блока к участку name текущего запроса.
+    Вложенные замеры того же участка не учитываются повторно,
+    поэтому можно оборачивать и вложенные сериализаторы.
+    Работает и как декоратор.
+    """
+
+    timing = current_timing.get()
+    if timing is None or name in timing.active:
+        yield
+        return
+    timing.active.add(name)
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timing.active.discard(name)
+        timing.add(name, elapsed_ms(start))
@@ -0,0 +1,68 @@
+from datetime import datetime, timezone
+from time import time_ns
+
+from django.db import transaction
+
+from .models import DataVersion
+
+# Наборы данных, версии которых отслеживаются.
+INGREDIENTS_VERSION = 'ingredients'
+TAGS_VERSION = 'tags'
+# Все рецепты (списки) и один рецепт по pk.
+RECIPES_VERSION = 'recipes'
+RECIPE_VERSION = 'recipe:{}'
+
+
+def get_versions(*names):
+    """
+    Версии наборов данных names одним запросом к базе.
+    Версия - время последнего изменения в наносекундах,
+    создаётся при первом обращении.
+    """
+
+    versions = dict(
+        DataVersion.objects.filter(name__in=names).values_list(
+            'name', 'version'
+        )
+    )
+    missing = [name for name in names if name not in versions]
+    if missing:
+        DataVersion.objects.bulk_create(
+            [DataVersion(name=name, version=time_ns()) for name in missing],
+            ignore_conflicts=True
+        )
+        versions.update(
+            DataVersion.objects.filter(name__in=missing).values_list(
+                'name', 'version'
+            )
+        )
+    return tuple(versions[name] for name in names)
+
+
+def get_version(name):
+    """Текущая версия набора данных name."""
+
+    return get_versions(name)[0]
+
+
+def bump_version(name):
+    """
+    Отмечает, что набор данных name изменился.
+    Внутри транзакции - после её фиксации: иначе другой процесс
+    может успеть закэшировать старые данные под новой версией.
+    """
+
+    transaction.on_commit(
+        lambda: DataVersion.objects.bulk_create(
+            [DataVersion(name=name, version=time_ns())],
+            update_conflicts=True,
+            unique_fields=('name',),
+            update_fields=('version',)
+        )
+    )
+
+
+def version_datetime(version):
+    """Время изменения, соответствующее версии."""
+
+    return datetime.fromtimestamp(version / 10 ** 9, tz=timezone.utc)
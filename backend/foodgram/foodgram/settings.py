@@ -21,6 +21,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'django_filters',
     'rest_framework.authtoken',
@@ -42,6 +43,13 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Замеры запросов к /api/ (Server-Timing и лог core.timing), по запросу.
+# Весь SQL пишется в лог для запросов дольше SERVER_TIMING_SLOW_MS.
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'False') == 'True'
+SERVER_TIMING_SLOW_MS = int(os.getenv('SERVER_TIMING_SLOW_MS', 500))
+if SERVER_TIMING:
+    MIDDLEWARE.append('core.middleware.ServerTimingMiddleware')
+
 ROOT_URLCONF = 'foodgram.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
@@ -73,6 +81,30 @@ DATABASES = {
     }
 }
 
+# Кэш ответов и счётчиков страниц. Ключи включают версии данных
+# (core.versions, хранятся в базе), так что локальный кэш воркера
+# не отдаёт устаревшее; общий (Redis, Memcached) просто экономнее.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.timing': {'handlers': ['console'], 'level': 'INFO'},
+        'api.shopping': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -1,55 +1,126 @@
-import csv
-
 from django.contrib import admin
 from django.contrib import messages
+from django.db.models import Exists, OuterRef
 from django.http import HttpResponseRedirect
 from django.shortcuts import render
 from django.urls import path
 from django.urls import reverse
 
 from .forms import IngredientImportForm
+from .importers import IngredientImportError, import_ingredients, read_csv
 from .models import (
     Tag, Recipe, Ingredient,
     RecipeIngredient, RecipeTag,
-    Favorite, ShoppingCart, IngredientImport
+    Favorite, ShoppingCart, IngredientImport,
+    ShoppingListItem
 )
+from .search import ingredient_index
 
-admin.site.register(Tag)
 admin.site.register(Favorite)
 admin.site.register(ShoppingCart)
 
 
+@admin.register(Tag)
+class TagAdmin(admin.ModelAdmin):
+    list_display = ('name', 'slug', 'color',)
+    search_fields = ('name', 'slug',)
+
+
 class RecipeIngredientInline(admin.TabularInline):
-    """Позволяет редактировать связанные объекты."""
+    """
+    Позволяет редактировать связанные объекты.
+    Ингредиент выбирается через автодополнение,
+    а не из <select> со всем справочником.
+    """
 
     model = RecipeIngredient
+    autocomplete_fields = ('ingredient',)
     min_num = 1
     extra = 1
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('ingredient')
+
 
 class RecipeTagInline(admin.TabularInline):
     """Позволяет редактировать связанные объекты."""
 
     model = RecipeTag
+    autocomplete_fields = ('tag',)
     min_num = 1
     extra = 1
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('tag')
+
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     list_display = ('name', 'author', 'count_favorites',)
+    list_select_related = ('author',)
     inlines = (RecipeIngredientInline, RecipeTagInline,)
     list_filter = ('tags',)
+    autocomplete_fields = ('author',)
+    # Счётчики меняются только F-выражениями.
+    readonly_fields = ('favorites_count', 'in_carts_count',)
+    # Поиск по началу строки, чтобы работали индексы.
     search_fields = (
-        "name",
-        "author__username",
-        "tags__name",
+        "^name",
+        "^author__username",
     )
+    # Не считать COUNT(*) по всей таблице на каждой странице.
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        К поиску по названию и автору добавляем поиск по тегам.
+        Теги ищем подзапросом EXISTS, чтобы рецепты не дублировались.
+        """
+
+        results, may_have_duplicates = super().get_search_results(
+            request, queryset, search_term
+        )
+        if search_term:
+            results |= queryset.filter(
+                Exists(
+                    RecipeTag.objects.filter(
+                        recipe=OuterRef('pk'),
+                        tag__name__istartswith=search_term
+                    )
+                )
+            )
+        return results, may_have_duplicates
 
     def count_favorites(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
 
     count_favorites.short_description = "В избранном"
+    count_favorites.admin_order_field = 'favorites_count'
+
+    def save_related(self, request, form, formsets, change):
+        """Правка ингредиентов в инлайне меняет списки покупок."""
+
+        super().save_related(request, form, formsets, change)
+        users = list(
+            form.instance.shopping_cart.values_list('user', flat=True)
+        )
+        if users:
+            ShoppingListItem.objects.refresh(users)
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, Recipe.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        """Удалённые рецепты уходят и из списков покупок."""
+
+        users = list(
+            ShoppingCart.objects.filter(
+                recipe__in=queryset
+            ).values_list('user', flat=True).distinct()
+        )
+        queryset.delete()
+        if users:
+            ShoppingListItem.objects.refresh(users)
 
 
 # Отображает панель для модели BookImport.
@@ -62,7 +133,25 @@ class BookImportAdmin(admin.ModelAdmin):
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'measurement_unit',)
+    # В списке ищется подстрока, автодополнение - по префиксу (ниже).
     search_fields = ('name',)
+    ordering = ('name',)
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Автодополнение в инлайнах рецепта отвечает из индекса
+        в памяти - тем же поиском, что и api.
+        """
+
+        if (
+            search_term
+            and request.resolver_match.url_name == 'autocomplete'
+        ):
+            found = ingredient_index.search(search_term)
+            return queryset.filter(
+                pk__in=[ingredient['id'] for ingredient in found]
+            ), False
+        return super().get_search_results(request, queryset, search_term)
 
     # Даем django(urlpatterns) знать
     # о существовании страницы с формой
@@ -82,30 +171,27 @@ class IngredientAdmin(admin.ModelAdmin):
                 # Сохраняем загруженный файл и делаем запись в базу.
                 form_object = form.save()
                 # Обработка csv файла.
-                with form_object.csv_file.open('r') as csv_file:
-                    rows = csv.reader(csv_file, delimiter=',')
-                    if next(rows) != ['name', 'measurement_unit']:
-                        # Обновляем страницу пользователя
-                        # с информацией о какой-то ошибке.
-                        messages.warning(
-                            request, 'Неверные заголовки у файла'
-                        )
-                        # Перенаправление на тот url, с которого
-                        # отправили запрос.
-                        return HttpResponseRedirect(
-                            request.path_info
-                        )
-                    for row in rows:
-                        # Добавляем данные в базу.
-                        Ingredient.objects.update_or_create(
-                            name=row[0],
-                            measurement_unit=row[1],
-                        )
+                try:
+                    with form_object.csv_file.open('r') as csv_file:
+                        result = import_ingredients(read_csv(csv_file))
+                except IngredientImportError as error:
+                    # Обновляем страницу пользователя
+                    # с информацией о какой-то ошибке.
+                    messages.warning(request, str(error))
+                    # Перенаправление на тот url, с которого
+                    # отправили запрос.
+                    return HttpResponseRedirect(
+                        request.path_info
+                    )
                 # Конец обработки файлы
                 # перенаправляем пользователя на главную страницу
                 # с сообщением об успехе.
                 url = reverse('admin:index')
-                messages.success(request, 'Файл успешно импортирован')
+                messages.success(
+                    request,
+                    f'Файл успешно импортирован. Добавлено: '
+                    f'{result.inserted}, пропущено: {result.skipped}.'
+                )
                 return HttpResponseRedirect(url)
         form = IngredientImportForm()
         return render(request, 'admin/csv_import_page.html', {'form': form})
@@ -0,0 +1,163 @@
+import random
+from collections import namedtuple
+from io import BytesIO
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image
+
+from core.parametrs import Parameters
+from core.versions import RECIPES_VERSION, bump_version
+from users.models import CustomUser, Subscription
+from .images import SOURCE, make_derivatives
+from .importers import CHUNK_SIZE, import_ingredients, read_json
+from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                     RecipeTag, ShoppingCart, ShoppingListItem, Tag)
+
+PASSWORD = 'synthetic-password'
+IMAGE_NAME = 'recipes/images/synthetic.png'
+TAGS = (
+    ('Завтрак', '#ffa500', 'breakfast'),
+    ('Обед', '#008000', 'lunch'),
+    ('Ужин', '#800080', 'dinner'),
+    ('Десерт', '#ff69b4', 'dessert'),
+    ('Выпечка', '#d2691e', 'bakery'),
+    ('Суп', '#ff0000', 'soup'),
+)
+
+DatasetSize = namedtuple(
+    'DatasetSize',
+    ('users', 'recipes', 'ingredients_per_recipe', 'tags_per_recipe',
+     'subscriptions', 'favorites', 'cart')
+)
+
+
+def get_email(seed, number):
+    """Почта сгенерированного пользователя: по ней входит бенчмарк."""
+
+    return f'synthetic{seed}-{number}@example.com'
+
+
+def bulk_insert(model, objects, chunk_size):
+    """Вставляет объекты пачками, не держа в памяти весь набор."""
+
+    objects = iter(objects)
+    created = []
+    while chunk := list(islice(objects, chunk_size)):
+        created.extend(model.objects.bulk_create(chunk))
+    return created
+
+
+def get_image():
+    """
+    Общая для всех рецептов картинка и её уменьшенные копии,
+    создаются один раз.
+    """
+
+    if not default_storage.exists(IMAGE_NAME):
+        buffer = BytesIO()
+        Image.new('RGB', (480, 320), (240, 200, 150)).save(buffer, 'PNG')
+        default_storage.save(IMAGE_NAME, ContentFile(buffer.getvalue()))
+    derivatives = Recipe.objects.filter(image=IMAGE_NAME).values_list(
+        'image_derivatives', flat=True
+    ).first()
+    if not derivatives or derivatives.get(SOURCE) != IMAGE_NAME:
+        derivatives = make_derivatives(IMAGE_NAME)
+    return IMAGE_NAME, derivatives
+
+
+def generate(size, ingredients_file, seed=0, chunk_size=CHUNK_SIZE):
+    """
+    Заполняет базу синтетическими данными размера size.
+    Ингредиенты берутся из ingredients_file (json из data/),
+    остальное вставляется bulk_create пачками по chunk_size.
+    При одинаковом seed получается одинаковый набор.
+    """
+
+    rng = random.Random(seed)
+    with transaction.atomic():
+        import_ingredients(read_json(ingredients_file), chunk_size)
+        ingredients = list(
+            Ingredient.objects.order_by('pk').values_list('pk', 'name')
+        )
+        for name, color, slug in TAGS:
+            Tag.objects.get_or_create(
+                slug=slug, defaults={'name': name, 'color': color}
+            )
+        tags = list(Tag.objects.order_by('pk').values_list('pk', flat=True))
+
+        password = make_password(PASSWORD)
+        users = [user.pk for user in bulk_insert(CustomUser, (
+            CustomUser(
+                email=get_email(seed, number),
+                username=f'synthetic{seed}-{number}',
+                first_name='Синтетический',
+                last_name=f'Пользователь {number}',
+                password=password
+            )
+            for number in range(size.users)
+        ), chunk_size)]
+
+        image, derivatives = get_image()
+        per_recipe = min(size.ingredients_per_recipe, len(ingredients))
+        tags_per_recipe = min(size.tags_per_recipe, len(tags))
+        authors = [rng.choice(users) for _ in range(size.recipes)]
+        dishes = [rng.choice(ingredients)[1] for _ in range(size.recipes)]
+        recipes = [recipe.pk for recipe in bulk_insert(Recipe, (
+            Recipe(
+                author_id=author,
+                name=f'{dish.capitalize()} по-домашнему'[
+                    :Parameters.MAX_LEN_INT_RECIPES.value
+                ],
+                text=f'Синтетический рецепт {number}.',
+                cooking_time=rng.randint(5, 120),
+                image=image,
+                image_derivatives=derivatives
+            )
+            for number, (author, dish) in enumerate(zip(authors, dishes))
+        ), chunk_size)]
+
+        bulk_insert(RecipeIngredient, (
+            RecipeIngredient(
+                recipe_id=recipe, ingredient_id=ingredient,
+                amount=rng.randint(1, 100)
+            )
+            for recipe in recipes
+            for ingredient, _ in rng.sample(ingredients, per_recipe)
+        ), chunk_size)
+        # --tags-per-recipe 0 - рецепты без тегов.
+        if tags_per_recipe:
+            bulk_insert(RecipeTag, (
+                RecipeTag(recipe_id=recipe, tag_id=tag)
+                for recipe in recipes
+                for tag in rng.sample(
+                    tags, rng.randint(1, tags_per_recipe)
+                )
+            ), chunk_size)
+
+        bulk_insert(Subscription, (
+            Subscription(user_id=user, author_id=author)
+            for user in users
+            for author in rng.sample(
+                users, min(size.subscriptions + 1, len(users))
+            )[:size.subscriptions]
+            if author != user
+        ), chunk_size)
+        for model, count in ((Favorite, size.favorites),
+                             (ShoppingCart, size.cart)):
+            bulk_insert(model, (
+                model(user_id=user, recipe_id=recipe)
+                for user in users
+                for recipe in rng.sample(recipes, min(count, len(recipes)))
+            ), chunk_size)
+
+        # bulk_create не обновляет счётчики и списки покупок.
+        Recipe.objects.filter(pk__in=recipes).recount()
+        CustomUser.objects.filter(pk__in=users).recount()
+        ShoppingListItem.objects.refresh(users=users)
+        # Сигналов не было: закэшированные списки рецептов устарели.
+        bump_version(RECIPES_VERSION)
+    return users, recipes
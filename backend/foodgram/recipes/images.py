@@ -0,0 +1,110 @@
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from core.parametrs import Parameters
+from core.versions import RECIPE_VERSION, RECIPES_VERSION, bump_version
+
+# Производные изображения рецепта: вариант -> (размер, формат, расширение).
+DERIVATIVES = {
+    'card': (Parameters.IMAGE_CARD_SIZE.value, 'JPEG', 'jpg'),
+    'card_webp': (Parameters.IMAGE_CARD_SIZE.value, 'WEBP', 'webp'),
+    'detail': (Parameters.IMAGE_DETAIL_SIZE.value, 'JPEG', 'jpg'),
+}
+# Под этим ключом хранится имя исходника, из которого они сделаны.
+SOURCE = 'source'
+# Чем Pillow отвечает на битый, неизвестный или слишком большой файл.
+IMAGE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+
+def render_derivative(image, size, image_format):
+    """Уменьшенная и пережатая копия image в формате image_format."""
+
+    image = image.copy()
+    image.thumbnail((size, size))
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    if image_format == 'JPEG' and image.mode == 'RGBA':
+        # У JPEG нет прозрачности: подкладываем белый фон.
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    buffer = BytesIO()
+    image.save(
+        buffer, image_format, quality=Parameters.IMAGE_QUALITY.value,
+        optimize=True
+    )
+    return buffer.getvalue()
+
+
+def delete_derivatives(derivatives):
+    """Удаляет файлы производных (исходник не трогает)."""
+
+    for variant, name in derivatives.items():
+        if variant != SOURCE and default_storage.exists(name):
+            default_storage.delete(name)
+
+
+def make_derivatives(name):
+    """
+    Создаёт рядом с исходником name все варианты из DERIVATIVES.
+    Возвращает {вариант: имя файла} вместе с именем исходника.
+    """
+
+    with default_storage.open(name) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    stem = os.path.splitext(name)[0]
+    derivatives = {SOURCE: name}
+    for variant, (size, image_format, extension) in DERIVATIVES.items():
+        derivatives[variant] = default_storage.save(
+            f'{stem}_{variant}.{extension}',
+            ContentFile(render_derivative(image, size, image_format))
+        )
+    return derivatives
+
+
+def save_derivatives(recipes, name):
+    """
+    Создаёт копии изображения name и записывает их рецептам recipes
+    (QuerySet рецептов с этим изображением). Версии рецептов
+    поднимаются: иначе закэшированные ответы отдавали бы старые
+    адреса копий. Возвращает копии и число обновлённых рецептов.
+    """
+
+    derivatives = make_derivatives(name)
+    pks = list(recipes.values_list('pk', flat=True))
+    updated = recipes.model.objects.filter(pk__in=pks).update(
+        image_derivatives=derivatives
+    )
+    if updated:
+        bump_version(RECIPES_VERSION)
+        for pk in pks:
+            bump_version(RECIPE_VERSION.format(pk))
+    return derivatives, updated
+
+
+def is_actual(recipe):
+    """Производные сделаны из текущего изображения рецепта."""
+
+    return recipe.image_derivatives.get(SOURCE) == recipe.image.name
+
+
+def get_derivative_name(image, derivatives, variant):
+    """
+    Имя файла варианта variant для изображения image
+    или None, если его ещё нет.
+    """
+
+    if derivatives.get(SOURCE) != image:
+        return None
+    return derivatives.get(variant)
+
+
+def get_derivative(recipe, variant):
+    return get_derivative_name(
+        recipe.image.name, recipe.image_derivatives, variant
+    )
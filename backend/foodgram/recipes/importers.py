@@ -0,0 +1,80 @@
+import csv
+import json
+from collections import namedtuple
+
+from django.db import transaction
+
+from core.parametrs import Parameters
+from core.versions import INGREDIENTS_VERSION, bump_version
+from .models import Ingredient
+
+HEADER = ['name', 'measurement_unit']
+CHUNK_SIZE = 1000
+
+ImportResult = namedtuple('ImportResult', ('read', 'inserted', 'skipped'))
+
+
+class IngredientImportError(ValueError):
+    """Файл ингредиентов не удалось разобрать."""
+
+
+def read_csv(file):
+    """Читает пары (название, единица) из csv построчно."""
+
+    rows = csv.reader(file, delimiter=',')
+    if next(rows, None) != HEADER:
+        raise IngredientImportError('Неверные заголовки у файла')
+    for row in rows:
+        if not row:
+            continue
+        if len(row) != len(HEADER):
+            raise IngredientImportError(
+                f'Неверная строка {rows.line_num}: {row}'
+            )
+        yield row[0], row[1]
+
+
+def read_json(file):
+    """Читает пары (название, единица) из json-списка объектов."""
+
+    try:
+        items = json.load(file)
+        for item in items:
+            yield item['name'], item['measurement_unit']
+    except (ValueError, TypeError, KeyError) as error:
+        raise IngredientImportError(f'Неверный json: {error}')
+
+
+def import_ingredients(rows, chunk_size=CHUNK_SIZE):
+    """
+    Загружает ингредиенты пачками по chunk_size.
+    Повторы внутри файла отбрасываются в памяти, уже существующие
+    пары отсекает ограничение name_measurement_unit_unique:
+    один INSERT ... ON CONFLICT DO NOTHING на пачку.
+    """
+
+    max_length = Parameters.MAX_LEN_INT_RECIPES.value
+    seen = set()
+    chunk = []
+    read = 0
+    with transaction.atomic():
+        before = Ingredient.objects.count()
+        for name, measurement_unit in rows:
+            read += 1
+            key = (name.strip(), measurement_unit.strip())
+            if (
+                key in seen or not all(key)
+                or max(map(len, key)) > max_length
+            ):
+                continue
+            seen.add(key)
+            chunk.append(Ingredient(name=key[0], measurement_unit=key[1]))
+            if len(chunk) >= chunk_size:
+                Ingredient.objects.bulk_create(chunk, ignore_conflicts=True)
+                chunk = []
+        if chunk:
+            Ingredient.objects.bulk_create(chunk, ignore_conflicts=True)
+        inserted = Ingredient.objects.count() - before
+    # bulk_create не посылает сигналов, поэтому версию поднимаем сами.
+    bump_version(INGREDIENTS_VERSION)
+    return ImportResult(read, inserted, read - inserted)
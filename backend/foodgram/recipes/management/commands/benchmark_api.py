@@ -0,0 +1,230 @@
+import json
+import random
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import cycle
+from pathlib import Path
+from statistics import mean
+from threading import local
+from time import perf_counter
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.dataset import PASSWORD, get_email
+from recipes.models import Favorite, Ingredient, Recipe, Tag
+from users.models import CustomUser
+
+# Число запросов к БД из заголовка ServerTimingMiddleware.
+QUERIES = re.compile(r'db;desc="(\d+) queries"')
+RECIPE_FILTERS = (
+    '', 'tags={tag}', 'tags={tag}&tags={other_tag}', 'is_favorited=1',
+    'is_in_shopping_cart=1', 'author={author}',
+)
+
+
+def percentile(values, share):
+    """Перцентиль по ближайшему рангу."""
+
+    values = sorted(values)
+    return values[max(0, round(share * len(values)) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный замер основных сценариев API на запущенном сервере: '
+        'p50/p95/p99, запросы в секунду и запросы к БД на запрос.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', default='http://localhost:8000',
+            help='Адрес запущенного сервера.'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='seed набора generate_dataset, под пользователем '
+                 'которого идут запросы.'
+        )
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Сколько раз выполнить каждый сценарий.'
+        )
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument(
+            '--warmup', type=int, default=5,
+            help='Сколько прогонов сценария не учитывать.'
+        )
+        parser.add_argument(
+            '--output', type=Path,
+            help='Куда сохранить результат в json для сравнения.'
+        )
+
+    def get_flows(self, user, rng):
+        """Сценарии: имя -> функция, возвращающая список запросов."""
+
+        recipes = list(Recipe.objects.values_list('pk', flat=True)[:1000])
+        # Рецепты не из избранного пользователя: добавляются и удаляются
+        # по кругу, чтобы параллельные прогоны не задевали один рецепт.
+        toggled = list(
+            Recipe.objects.exclude(
+                pk__in=Favorite.objects.filter(user=user).values('recipe')
+            ).values_list('pk', flat=True)[:1000]
+        )
+        tags = list(Tag.objects.values_list('slug', flat=True))
+        authors = list(
+            CustomUser.objects.filter(
+                recipes_count__gt=0
+            ).values_list('pk', flat=True)[:1000]
+        )
+        prefixes = [
+            name[:rng.randint(1, 3)] for name in
+            Ingredient.objects.values_list('name', flat=True)[:1000]
+        ]
+        if not (recipes and toggled and tags and authors and prefixes):
+            raise CommandError('Сначала заполните базу: generate_dataset.')
+        rng.shuffle(toggled)
+        toggled = cycle(toggled)
+
+        def recipe_list():
+            query = rng.choice(RECIPE_FILTERS).format(
+                tag=rng.choice(tags), other_tag=rng.choice(tags),
+                author=rng.choice(authors)
+            )
+            return [('GET', f'/api/recipes/?limit=6&{query}', {})]
+
+        def favorite_toggle():
+            url = f'/api/recipes/{next(toggled)}/favorite/'
+            return [('POST', url, {}), ('DELETE', url, {})]
+
+        return {
+            'recipe_list': recipe_list,
+            'recipe_detail': lambda: [
+                ('GET', f'/api/recipes/{rng.choice(recipes)}/', {})
+            ],
+            'subscriptions': lambda: [
+                ('GET', '/api/users/subscriptions/?limit=6&recipes_limit=3',
+                 {})
+            ],
+            'ingredient_search': lambda: [
+                ('GET', f'/api/ingredients/?name={rng.choice(prefixes)}', {})
+            ],
+            'favorite_toggle': favorite_toggle,
+            'download_shopping_cart': lambda: [
+                ('GET', '/api/recipes/download_shopping_cart/',
+                 {'Accept': 'text/plain'})
+            ],
+        }
+
+    def login(self, url, email):
+        response = requests.post(
+            f'{url}/api/auth/token/login/',
+            json={'email': email, 'password': PASSWORD}
+        )
+        if response.status_code != 200:
+            raise CommandError(f'Не удалось войти как {email}.')
+        return response.json()['auth_token']
+
+    def run_flow(self, url, token, flow, runs, concurrency):
+        """Прогоняет сценарий runs раз в concurrency потоков."""
+
+        plans = [flow() for _ in range(runs)]
+        # Своя сессия (keep-alive соединение) на каждый поток.
+        sessions = local()
+
+        def run(plan):
+            if not hasattr(sessions, 'session'):
+                sessions.session = requests.Session()
+                sessions.session.headers['Authorization'] = f'Token {token}'
+            session = sessions.session
+            samples = []
+            for method, path, headers in plan:
+                start = perf_counter()
+                try:
+                    response = session.request(
+                        method, url + path, headers=headers
+                    )
+                    response.content
+                except requests.RequestException:
+                    samples.append((perf_counter() - start, None, None))
+                    continue
+                queries = QUERIES.search(
+                    response.headers.get('Server-Timing', '')
+                )
+                samples.append((
+                    perf_counter() - start, response.status_code,
+                    int(queries.group(1)) if queries else None
+                ))
+            return samples
+
+        start = perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(run, plans))
+        return perf_counter() - start, [
+            sample for samples in results for sample in samples
+        ]
+
+    def get_stats(self, duration, samples):
+        latencies = [sample[0] * 1000 for sample in samples]
+        queries = [sample[2] for sample in samples if sample[2] is not None]
+        return {
+            'requests': len(samples),
+            'errors': sum(
+                1 for sample in samples
+                if sample[1] is None or sample[1] >= 400
+            ),
+            'p50_ms': round(percentile(latencies, 0.50), 1),
+            'p95_ms': round(percentile(latencies, 0.95), 1),
+            'p99_ms': round(percentile(latencies, 0.99), 1),
+            'rps': round(len(samples) / duration, 1),
+            'queries': round(mean(queries), 1) if queries else None,
+        }
+
+    def handle(self, *args, **options):
+        url = options['url'].rstrip('/')
+        email = get_email(options['seed'], 0)
+        user = CustomUser.objects.filter(email=email).first()
+        if user is None:
+            raise CommandError(
+                f'Нет пользователя {email}: запустите generate_dataset '
+                f'--seed {options["seed"]}.'
+            )
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests и --concurrency больше нуля.')
+        rng = random.Random(options['seed'])
+        token = self.login(url, email)
+        report = {
+            'url': url,
+            'date': datetime.now(timezone.utc).isoformat(),
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'flows': {},
+        }
+        self.stdout.write(
+            f'{"сценарий":<24}{"запросов":>9}{"ошибок":>8}{"p50":>9}'
+            f'{"p95":>9}{"p99":>9}{"rps":>8}{"SQL":>6}'
+        )
+        for name, flow in self.get_flows(user, rng).items():
+            if options['warmup']:
+                self.run_flow(
+                    url, token, flow, options['warmup'],
+                    options['concurrency']
+                )
+            stats = self.get_stats(*self.run_flow(
+                url, token, flow, options['requests'], options['concurrency']
+            ))
+            report['flows'][name] = stats
+            queries = '-' if stats['queries'] is None else stats['queries']
+            self.stdout.write(
+                f'{name:<24}{stats["requests"]:>9}{stats["errors"]:>8}'
+                f'{stats["p50_ms"]:>9}{stats["p95_ms"]:>9}'
+                f'{stats["p99_ms"]:>9}{stats["rps"]:>8}{queries:>6}'
+            )
+        if options['output']:
+            options['output'].write_text(
+                json.dumps(report, ensure_ascii=False, indent=2)
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f'Результат сохранён в {options["output"]}.'
+            ))
@@ -0,0 +1,106 @@
+import json
+from statistics import median
+from time import perf_counter
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.test import APIRequestFactory
+
+from api.serializers import RecipeReadSerializer, RecipesSerializer
+from core.timing import RequestTiming, elapsed_ms
+from recipes.models import Recipe
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет ответ быстрого RecipeReadSerializer с RecipesSerializer '
+        'и сравнивает их скорость на одной странице рецептов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit', type=int, default=60,
+            help='Сколько рецептов на странице.'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Сколько раз сериализовать страницу для замера.'
+        )
+
+    def get_users(self):
+        """Аноним и пользователь с подписками, чтобы флаги были разными."""
+
+        users = [AnonymousUser()]
+        user = (
+            CustomUser.objects.filter(subscription__isnull=False).first()
+            or CustomUser.objects.first()
+        )
+        if user is not None:
+            users.append(user)
+        return users
+
+    def serialize(self, serializer_class, queryset, context):
+        """Данные страницы, общее время в мс и время SQL в мс."""
+
+        timing = RequestTiming()
+        start = perf_counter()
+        with connection.execute_wrapper(timing):
+            data = serializer_class(
+                list(queryset.all()), many=True, context=context
+            ).data
+        return json.loads(json.dumps(data)), elapsed_ms(start), timing.db_ms
+
+    def run(self, serializer_class, queryset, context, repeat):
+        """Медианы общего времени и времени без SQL."""
+
+        samples = [
+            self.serialize(serializer_class, queryset, context)[1:]
+            for _ in range(repeat)
+        ]
+        return (
+            median(total for total, db in samples),
+            median(total - db for total, db in samples)
+        )
+
+    def handle(self, *args, **options):
+        if options['limit'] < 1 or options['repeat'] < 1:
+            raise CommandError('--limit и --repeat больше нуля.')
+        ids = list(
+            Recipe.objects.values_list('pk', flat=True)[:options['limit']]
+        )
+        if not ids:
+            raise CommandError('Сначала заполните базу: generate_dataset.')
+        factory = APIRequestFactory()
+        for user in self.get_users():
+            request = factory.get('/api/recipes/')
+            request.user = user
+            rows = Recipe.objects.filter(pk__in=ids).with_user_flags(
+                user
+            ).values(*RecipeReadSerializer.get_row_fields())
+            recipes = Recipe.objects.filter(pk__in=ids).with_relations(user)
+            for variant in ('card', 'detail'):
+                context = {'request': request, 'image_variant': variant}
+                fast = self.serialize(RecipeReadSerializer, rows, context)[0]
+                slow = self.serialize(RecipesSerializer, recipes, context)[0]
+                if fast != slow:
+                    raise CommandError(
+                        f'Ответы расходятся ({user}, {variant}).'
+                    )
+            fast = self.run(
+                RecipeReadSerializer, rows, context, options['repeat']
+            )
+            slow = self.run(
+                RecipesSerializer, recipes, context, options['repeat']
+            )
+            self.stdout.write(
+                f'{user}: RecipesSerializer {slow[0]:.1f} мс '
+                f'(без SQL {slow[1]:.1f}), RecipeReadSerializer '
+                f'{fast[0]:.1f} мс (без SQL {fast[1]:.1f}), быстрее в '
+                f'{slow[0] / fast[0]:.1f} раза (без SQL в '
+                f'{slow[1] / fast[1]:.1f}).'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Ответы совпадают на {len(ids)} рецептах.'
+        ))
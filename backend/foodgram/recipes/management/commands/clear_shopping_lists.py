@@ -0,0 +1,44 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.shopping import PDF_DIR, pdf_storage
+from recipes.models import ShoppingListPDF
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет PDF списков покупок и задачи на их рендер старше '
+        '--max-age часов. Запускается по расписанию; удалённый список '
+        'при следующем скачивании рендерится заново.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age', type=int, default=24,
+            help='Сколько часов хранить PDF.'
+        )
+
+    def handle(self, *args, **options):
+        if options['max_age'] < 0:
+            raise CommandError('--max-age не меньше нуля.')
+        deadline = timezone.now() - timedelta(hours=options['max_age'])
+        # Брошенные задачи: список так и не отрендерился.
+        ShoppingListPDF.objects.filter(updated__lt=deadline).delete()
+        if not pdf_storage.exists(PDF_DIR):
+            return
+        _, files = pdf_storage.listdir(PDF_DIR)
+        deleted = 0
+        for file in files:
+            name = PDF_DIR + file
+            try:
+                if pdf_storage.get_modified_time(name) < deadline:
+                    pdf_storage.delete(name)
+                    deleted += 1
+            except FileNotFoundError:
+                # Файл уже удалил параллельный запуск.
+                continue
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено PDF: {deleted} из {len(files)}.'
+        ))
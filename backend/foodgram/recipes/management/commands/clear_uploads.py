@@ -0,0 +1,69 @@
+import re
+from datetime import timedelta
+from itertools import islice
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.uploads import FORMATS, TOKEN_MAX_AGE, UPLOAD_DIR
+from recipes.models import Recipe
+
+# Имена, которые даёт save_upload; у копий recipes.images есть суффикс.
+UPLOAD_NAME = re.compile(
+    r'[0-9a-f]{8}(-[0-9a-f]{4}){3}-[0-9a-f]{12}\.(%s)'
+    % '|'.join(FORMATS.values())
+)
+# Запас на запрос, который прочитал токен перед самым истечением.
+GRACE = timedelta(hours=1)
+CHUNK_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет изображения, загруженные через /api/uploads/, '
+        'которые так и не стали изображением рецепта, пока жил токен. '
+        'Запускается по расписанию.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать, ничего не удаляя.'
+        )
+
+    def handle(self, *args, **options):
+        if not default_storage.exists(UPLOAD_DIR):
+            return
+        deadline = (
+            timezone.now() - timedelta(seconds=TOKEN_MAX_AGE) - GRACE
+        )
+        _, files = default_storage.listdir(UPLOAD_DIR)
+        names = []
+        for file in files:
+            if not UPLOAD_NAME.fullmatch(file):
+                continue
+            name = UPLOAD_DIR + file
+            try:
+                if default_storage.get_modified_time(name) < deadline:
+                    names.append(name)
+            except FileNotFoundError:
+                # Файл уже удалил параллельный запуск.
+                continue
+        # Токен истёк, так что на файл может ссылаться только рецепт.
+        unused = []
+        names = iter(names)
+        while chunk := list(islice(names, CHUNK_SIZE)):
+            used = set(
+                Recipe.objects.filter(image__in=chunk).values_list(
+                    'image', flat=True
+                )
+            )
+            unused.extend(name for name in chunk if name not in used)
+        if not options['dry_run']:
+            for name in unused:
+                default_storage.delete(name)
+        self.stdout.write(self.style.SUCCESS(
+            f'Неиспользованных загрузок: {len(unused)}, '
+            f'удалено: {0 if options["dry_run"] else len(unused)}.'
+        ))
@@ -0,0 +1,83 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from recipes.dataset import PASSWORD, DatasetSize, generate, get_email
+from recipes.importers import CHUNK_SIZE, IngredientImportError
+
+# Копия data/ingredients.json из корня репозитория: корень не входит
+# в контекст сборки образа backend, а эта папка входит.
+INGREDIENTS_FILE = settings.BASE_DIR / 'data' / 'ingredients.json'
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими пользователями, рецептами, '
+        'подписками, избранным и корзинами для нагрузочных замеров.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, default=8
+        )
+        parser.add_argument(
+            '--tags-per-recipe', type=int, default=2,
+            help='Сколько тегов у рецепта, не больше (0 - без тегов).'
+        )
+        parser.add_argument(
+            '--subscriptions', type=int, default=10,
+            help='Подписок на одного пользователя.'
+        )
+        parser.add_argument(
+            '--favorites', type=int, default=20,
+            help='Рецептов в избранном у одного пользователя.'
+        )
+        parser.add_argument(
+            '--cart', type=int, default=5,
+            help='Рецептов в корзине у одного пользователя.'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Один seed - один и тот же набор данных.'
+        )
+        parser.add_argument(
+            '--ingredients', type=Path, default=INGREDIENTS_FILE,
+            help='json с ингредиентами, по умолчанию data/ingredients.json.'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help='Сколько строк вставлять одним запросом.'
+        )
+
+    def handle(self, *args, **options):
+        size = DatasetSize(
+            *(options[field] for field in DatasetSize._fields)
+        )
+        if size.users < 1 or min(size) < 0:
+            raise CommandError('Нужен хотя бы один пользователь.')
+        if not options['ingredients'].is_file():
+            raise CommandError(
+                f'Нет файла ингредиентов {options["ingredients"]}, '
+                'укажите путь в --ingredients.'
+            )
+        try:
+            with options['ingredients'].open(encoding='utf-8') as file:
+                users, recipes = generate(
+                    size, file, options['seed'], options['chunk_size']
+                )
+        except (OSError, IngredientImportError) as error:
+            raise CommandError(error)
+        except IntegrityError:
+            raise CommandError(
+                f'Набор с seed {options["seed"]} уже создан, '
+                'укажите другой --seed.'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(users)}, '
+            f'рецептов: {len(recipes)}. '
+            f'Вход: {get_email(options["seed"], 0)} / {PASSWORD}'
+        ))
@@ -0,0 +1,39 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.importers import (CHUNK_SIZE, IngredientImportError,
+                               import_ingredients, read_csv, read_json)
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
+
+
+class Command(BaseCommand):
+    help = 'Загружает ингредиенты из csv или json (например, data/).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=Path)
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help='Сколько строк вставлять одним запросом.'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        reader = READERS.get(path.suffix.lower())
+        if reader is None:
+            raise CommandError('Поддерживаются только .csv и .json файлы.')
+        try:
+            with path.open(encoding='utf-8', newline='') as file:
+                result = import_ingredients(
+                    reader(file), options['chunk_size']
+                )
+        except (OSError, IngredientImportError) as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано: {result.read}, добавлено: {result.inserted}, '
+            f'пропущено: {result.skipped}.'
+        ))
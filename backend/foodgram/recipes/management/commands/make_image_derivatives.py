@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import (IMAGE_ERRORS, SOURCE, delete_derivatives,
+                            save_derivatives)
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт уменьшенные копии изображений рецептов, '
+        'загруженных до их появления.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересоздать копии и для тех, у кого они уже есть.'
+        )
+
+    def handle(self, *args, **options):
+        # Одно изображение может быть у многих рецептов:
+        # копии делаются один раз на файл, старые удаляются.
+        names = {}
+        for name, derivatives in Recipe.objects.exclude(
+            image=''
+        ).values_list('image', 'image_derivatives').iterator():
+            if derivatives.get(SOURCE) != name:
+                names.setdefault(name, {})
+            elif options['force']:
+                names.setdefault(name, derivatives)
+        made = failed = 0
+        for name, old in sorted(names.items()):
+            try:
+                _, updated = save_derivatives(
+                    Recipe.objects.filter(image=name), name
+                )
+            except IMAGE_ERRORS as error:
+                failed += 1
+                self.stderr.write(f'{name}: {error}')
+                continue
+            made += updated
+            delete_derivatives(old)
+        self.stdout.write(self.style.SUCCESS(
+            f'Файлов: {len(names)}, обновлено рецептов: {made}, '
+            f'ошибок: {failed}.'
+        ))
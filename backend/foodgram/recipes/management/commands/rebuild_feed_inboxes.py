@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+
+from recipes.models import FeedItem
+from users.models import CustomUser, Subscription
+
+
+class Command(BaseCommand):
+    help = (
+        'Включает заранее собранную ленту подписок (inbox) тем, '
+        'кто подписан не меньше чем на --min-subscriptions авторов, '
+        'выключает остальным и пересобирает ленты.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-subscriptions', type=int, default=1000,
+            help='С какого числа подписок лента читается из inbox.'
+        )
+
+    def handle(self, *args, **options):
+        if options['min_subscriptions'] < 1:
+            raise CommandError('--min-subscriptions больше нуля.')
+        heavy = Subscription.objects.values('user').annotate(
+            subscriptions=Count('pk')
+        ).filter(
+            subscriptions__gte=options['min_subscriptions']
+        ).values('user')
+        with transaction.atomic():
+            CustomUser.objects.filter(feed_inbox=True).exclude(
+                pk__in=heavy
+            ).update(feed_inbox=False)
+            users = CustomUser.objects.filter(
+                pk__in=heavy, feed_inbox=False
+            ).update(feed_inbox=True)
+            FeedItem.objects.all().delete()
+            FeedItem.objects.fill()
+        self.stdout.write(self.style.SUCCESS(
+            f'Inbox включён: {users} новых, всего '
+            f'{CustomUser.objects.filter(feed_inbox=True).count()}; '
+            f'рецептов в лентах: {FeedItem.objects.count()}.'
+        ))
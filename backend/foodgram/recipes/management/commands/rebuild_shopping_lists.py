@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingCart, ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет списки покупок (ShoppingListItem) с корзинами '
+        'и пересобирает расходящиеся.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить, ничего не записывая.'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Сколько пользователей обрабатывать за раз.'
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        users = list(
+            ShoppingCart.objects.values_list(
+                'user', flat=True
+            ).distinct().order_by('user')
+        )
+        drifted_users = 0
+        drifted_rows = 0
+        for start in range(0, len(users), chunk_size):
+            chunk = users[start:start + chunk_size]
+            totals = ShoppingListItem.objects.get_totals(chunk)
+            stored = {
+                (user_id, ingredient_id): amount
+                for user_id, ingredient_id, amount in
+                ShoppingListItem.objects.filter(
+                    user__in=chunk
+                ).values_list('user', 'ingredient', 'amount')
+            }
+            drift = {
+                key for key in totals.keys() | stored.keys()
+                if totals.get(key) != stored.get(key)
+            }
+            if not drift:
+                continue
+            drifted_rows += len(drift)
+            drifted_users += len({user_id for user_id, _ in drift})
+            if not options['check']:
+                with transaction.atomic():
+                    ShoppingListItem.objects.refresh(chunk)
+        orphans = ShoppingListItem.objects.exclude(
+            user__in=ShoppingCart.objects.values('user')
+        )
+        orphans_count = orphans.count()
+        if orphans_count and not options['check']:
+            orphans.delete()
+        self.stdout.write(
+            f'Пользователей с корзиной: {len(users)}. '
+            f'Расхождений: {drifted_rows} строк у {drifted_users} '
+            f'пользователей, лишних строк без корзины: {orphans_count}.'
+        )
+        if options['check'] and (drifted_rows or orphans_count):
+            raise CommandError('Списки покупок расходятся с корзинами.')
+        if drifted_rows or orphans_count:
+            self.stdout.write(self.style.SUCCESS('Списки пересобраны.'))
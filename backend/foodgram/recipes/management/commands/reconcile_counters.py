@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import Recipe
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет счётчики рецептов (избранное, корзины) и пользователей '
+        '(рецепты, подписчики) с живыми данными и чинит расхождения.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить, ничего не записывая.'
+        )
+
+    def handle(self, *args, **options):
+        drifted_recipes = list(
+            Recipe.objects.drifted_counters().values_list('pk', flat=True)
+        )
+        drifted_users = list(
+            CustomUser.objects.drifted_counters().values_list('pk', flat=True)
+        )
+        self.stdout.write(
+            f'Расхождений: рецептов - {len(drifted_recipes)}, '
+            f'пользователей - {len(drifted_users)}.'
+        )
+        if not (drifted_recipes or drifted_users):
+            return
+        if options['check']:
+            raise CommandError('Счётчики расходятся с живыми данными.')
+        # Пересчитываем только разошедшиеся строки, одним UPDATE на таблицу.
+        with transaction.atomic():
+            Recipe.objects.filter(pk__in=drifted_recipes).recount()
+            CustomUser.objects.filter(pk__in=drifted_users).recount()
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны.'))
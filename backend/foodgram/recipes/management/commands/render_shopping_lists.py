@@ -0,0 +1,69 @@
+from time import sleep
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from api.shopping import logger, pdf_storage, render_pdf
+from recipes.models import ShoppingListPDF
+
+
+class Command(BaseCommand):
+    help = (
+        'Рендерит PDF списков покупок из очереди ShoppingListPDF. '
+        'Работает отдельным процессом рядом с gunicorn; воркеров может '
+        'быть несколько, задача достаётся одному из них.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Обработать очередь и выйти.'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=1,
+            help='Пауза в секундах, когда очередь пуста.'
+        )
+
+    def handle(self, *args, **options):
+        if options['interval'] <= 0:
+            raise CommandError('--interval больше нуля.')
+        while True:
+            while self.render_next():
+                pass
+            if options['once']:
+                return
+            sleep(options['interval'])
+
+    def render_next(self):
+        """
+        Рендерит одну задачу. False, если очередь пуста или рендер
+        не удался: следующая попытка будет после паузы --interval.
+        """
+
+        with transaction.atomic():
+            # Строка заблокирована, пока идёт рендер: другие воркеры
+            # её пропускают, а не рендерят тот же список ещё раз.
+            task = ShoppingListPDF.objects.filter(
+                attempts__lt=getattr(
+                    settings, 'SHOPPING_LIST_RENDER_ATTEMPTS', 3
+                )
+            ).select_for_update(skip_locked=True).order_by('updated').first()
+            if task is None:
+                return False
+            if pdf_storage.exists(task.name):
+                ShoppingListPDF.objects.filter(name=task.name).delete()
+                return True
+            try:
+                elapsed = render_pdf(task.ingredients, task.name)
+            except Exception:
+                logger.exception('Не удалось создать PDF %s', task.name)
+                ShoppingListPDF.objects.filter(name=task.name).update(
+                    attempts=F('attempts') + 1, updated=timezone.now()
+                )
+                return False
+            ShoppingListPDF.objects.filter(name=task.name).delete()
+            logger.info('PDF %s создан за %.1f мс', task.name, elapsed)
+            return True
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.4 on 2026-10-18 02:09
+
+from django.db import migrations, models
+
+from core.expressions import count_related
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    CustomUser = apps.get_model('users', 'CustomUser')
+    Recipe.objects.update(
+        favorites_count=count_related(Recipe, 'favorites'),
+        in_carts_count=count_related(Recipe, 'shopping_cart')
+    )
+    CustomUser.objects.update(
+        recipes_count=count_related(CustomUser, 'user_recipes'),
+        followers_count=count_related(CustomUser, 'author')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_shoppinglistitem'),
+        ('users', '0004_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='В корзинах'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
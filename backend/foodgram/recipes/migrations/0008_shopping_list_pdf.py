@@ -0,0 +1,26 @@
+# Generated by Django 4.2.4 on 2026-10-18 03:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_counters_not_editable'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListPDF',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Файл')),
+                ('ingredients', models.JSONField(verbose_name='Ингредиенты')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Неудачных попыток')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Изменена')),
+            ],
+            options={
+                'verbose_name': 'PDF списка покупок',
+                'verbose_name_plural': 'PDF списков покупок',
+            },
+        ),
+    ]
@@ -1,13 +1,23 @@
-from django.db import models
-from django.db.models import UniqueConstraint
+from itertools import islice
 
+from django.contrib.postgres.indexes import OpClass
+from django.db import connections, models, transaction
+from django.db.models import (Exists, F, Index, OuterRef, Prefetch, Sum,
+                              UniqueConstraint, Value)
+from django.db.models.functions import Greatest, Upper
+
+from core.expressions import count_related
+from core.models import CountersModelMixin
 from core.parametrs import Parameters
-from users.models import CustomUser
+from users.models import CustomUser, Subscription
 from .validators import (
     validate_slug,
     validate_cooking_time,
     validate_recipe_ingredient)
 
+# Флаги рецепта для текущего пользователя.
+USER_FLAGS = ('is_favorited', 'is_in_shopping_cart')
+
 
 class Ingredient(models.Model):
     """Модель Ингредиентов."""
@@ -28,6 +38,13 @@ class Ingredient(models.Model):
                 name='name_measurement_unit_unique'
             )
         ]
+        indexes = [
+            # Поиск по началу названия без учёта регистра (name__istartswith).
+            Index(
+                OpClass(Upper('name'), name='text_pattern_ops'),
+                name='ingredient_name_upper_idx'
+            )
+        ]
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
 
@@ -67,9 +84,105 @@ class Tag(models.Model):
         return f"{self.name}"
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+    """Набор запросов к рецептам."""
+
+    def with_user_flags(self, user, flags=USER_FLAGS):
+        """
+        Аннотирует рецепты флагами из flags (is_favorited,
+        is_in_shopping_cart) для пользователя одним запросом
+        на всю выборку.
+        """
+
+        if not user.is_authenticated:
+            return self.annotate(**{flag: Value(False) for flag in flags})
+        relations = {
+            'is_favorited': Favorite,
+            'is_in_shopping_cart': ShoppingCart
+        }
+        return self.annotate(**{
+            flag: Exists(
+                relations[flag].objects.filter(
+                    user=user, recipe=OuterRef('pk')
+                )
+            )
+            for flag in flags
+        })
+
+    def with_relations(self, user):
+        """
+        Всё, что выводит RecipesSerializer: теги, ингредиенты
+        и автор со статусом подписки - по запросу на связь для
+        всей выборки, плюс флаги пользователя.
+        """
+
+        return self.prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.order_by('id')),
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'
+                ).order_by('id')
+            ),
+            Prefetch(
+                'author', queryset=CustomUser.objects.with_subscription(user)
+            )
+        ).with_user_flags(user)
+
+    def feed(self, user):
+        """
+        Рецепты авторов, на которых подписан user, с датой для
+        сортировки ленты feed_pub_date. Если у user включён inbox,
+        лента читается из FeedItem по индексу (user, pub_date),
+        иначе - по списку авторов из подписок: с подзапросом (IN
+        или EXISTS) планировщик обходит все рецепты по pub_date, даже
+        если у авторов рецептов нет, а со списком берёт индекс
+        (author, pub_date). Подписок без inbox немного, см.
+        rebuild_feed_inboxes.
+        """
+
+        if user.feed_inbox:
+            return self.filter(feed_items__user=user).annotate(
+                feed_pub_date=F('feed_items__pub_date')
+            )
+        return self.filter(
+            author__in=list(
+                Subscription.objects.filter(user=user).values_list(
+                    'author', flat=True
+                )
+            )
+        ).annotate(feed_pub_date=F('pub_date'))
+
+    def with_actual_counters(self):
+        """Аннотирует рецепты счётчиками, посчитанными по живым данным."""
+
+        return self.annotate(
+            actual_favorites_count=count_related(Recipe, 'favorites'),
+            actual_in_carts_count=count_related(Recipe, 'shopping_cart')
+        )
+
+    def drifted_counters(self):
+        """Рецепты, у которых счётчики разошлись с живыми данными."""
+
+        return self.with_actual_counters().exclude(
+            favorites_count=F('actual_favorites_count'),
+            in_carts_count=F('actual_in_carts_count')
+        )
+
+    def recount(self):
+        """Пересчитывает счётчики одним UPDATE на всю выборку."""
+
+        return self.update(
+            favorites_count=count_related(Recipe, 'favorites'),
+            in_carts_count=count_related(Recipe, 'shopping_cart')
+        )
+
+
+class Recipe(CountersModelMixin, models.Model):
     """Модель рецептов."""
 
+    counter_fields = ('favorites_count', 'in_carts_count')
+
     tags = models.ManyToManyField(
         to=Tag,
         verbose_name='Теги',
@@ -91,6 +204,13 @@ class Recipe(models.Model):
         verbose_name='Изображение',
         upload_to='recipes/images/'
     )
+    # Уменьшенные копии изображения (recipes.images), {вариант: файл}.
+    image_derivatives = models.JSONField(
+        verbose_name='Производные изображения',
+        default=dict,
+        blank=True,
+        editable=False
+    )
 
     text = models.TextField(
         verbose_name='Описание'
@@ -107,12 +227,39 @@ class Recipe(models.Model):
         verbose_name='Дата публикации.',
         auto_now_add=True
     )
+    # Счётчики обновляются F-выражениями в recipes.signals,
+    # сверяются командой reconcile_counters.
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='В корзинах',
+        default=0,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         # В порядке убывания
         ordering = ('pub_date',)
+        indexes = [
+            # Лента и курсорная пагинация: сортировка (pub_date, id).
+            Index(fields=('pub_date', 'id'), name='recipe_pub_date_idx'),
+            # Фильтр по автору и рецепты в подписках.
+            Index(
+                fields=('author', 'pub_date', 'id'),
+                name='recipe_author_pub_date_idx'
+            ),
+            Index(
+                OpClass(Upper('name'), name='text_pattern_ops'),
+                name='recipe_name_upper_idx'
+            )
+        ]
 
     def __str__(self) -> str:
         return f"{self.name}"
@@ -174,6 +321,10 @@ class RecipeTag(models.Model):
                 name='recipe_tag_unique'
             )
         ]
+        indexes = [
+            # Фильтр рецептов по тегу; (recipe, tag) покрыт ограничением.
+            Index(fields=('tag', 'recipe'), name='recipe_tag_tag_recipe_idx')
+        ]
         verbose_name = 'M2M RecipeTag'
         verbose_name_plural = 'M2M RecipeTag'
 
@@ -181,9 +332,77 @@ class RecipeTag(models.Model):
         return f"{self.recipe} {self.tag}"
 
 
+class UserRecipeQuerySet(models.QuerySet):
+    """
+    Набор запросов к связям пользователя с рецептами (корзина,
+    избранное). add и remove - по одному запросу без проверки
+    заранее: что изменилось, видно по затронутым строкам,
+    поэтому параллельные запросы не падают на уникальности.
+    Это сырой SQL без сигналов, счётчики рецептов меняются здесь же.
+    """
+
+    def execute(self, sql, params):
+        """Выполняет sql над таблицей связи, возвращает id рецептов."""
+
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        opts = self.model._meta
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(
+                table=quote(opts.db_table),
+                user=quote(opts.get_field('user').column),
+                recipe=quote(opts.get_field('recipe').column),
+                recipes=quote(Recipe._meta.db_table),
+                id=quote(Recipe._meta.pk.column)
+            ), params)
+            return sorted(recipe for recipe, in cursor.fetchall())
+
+    def change_counters(self, recipes, delta):
+        if recipes:
+            counter = self.model.recipe_counter
+            Recipe.objects.filter(pk__in=recipes).update(
+                **{counter: Greatest(F(counter) + delta, 0)}
+            )
+
+    def add(self, user, recipes):
+        """
+        Добавляет пользователю рецепты (id), которых у него нет.
+        Уже добавленные и несуществующие пропускаются.
+        Возвращает id добавленных рецептов.
+        """
+
+        with transaction.atomic(using=self.db):
+            added = self.execute(
+                'INSERT INTO {table} ({user}, {recipe}) '
+                'SELECT %s, {id} FROM {recipes} WHERE {id} = ANY(%s) '
+                'ON CONFLICT DO NOTHING RETURNING {recipe}',
+                (user.pk, list(recipes))
+            )
+            self.change_counters(added, 1)
+        return added
+
+    def remove(self, user, recipes):
+        """
+        Убирает у пользователя рецепты (id).
+        Возвращает id действительно удалённых.
+        """
+
+        with transaction.atomic(using=self.db):
+            removed = self.execute(
+                'DELETE FROM {table} '
+                'WHERE {user} = %s AND {recipe} = ANY(%s) '
+                'RETURNING {recipe}',
+                (user.pk, list(recipes))
+            )
+            self.change_counters(removed, -1)
+        return removed
+
+
 class ShoppingCart(models.Model):
     """Модель корзины."""
 
+    # Счётчик рецепта, который отражает эту связь.
+    recipe_counter = 'in_carts_count'
     user = models.ForeignKey(
         to=CustomUser,
         verbose_name='Пользователь',
@@ -198,6 +417,8 @@ class ShoppingCart(models.Model):
         on_delete=models.CASCADE,
     )
 
+    objects = UserRecipeQuerySet.as_manager()
+
     class Meta:
         constraints = [
             UniqueConstraint(
@@ -215,6 +436,8 @@ class ShoppingCart(models.Model):
 class Favorite(models.Model):
     """Модель избранного."""
 
+    # Счётчик рецепта, который отражает эту связь.
+    recipe_counter = 'favorites_count'
     user = models.ForeignKey(
         to=CustomUser,
         verbose_name='Пользователь',
@@ -229,6 +452,8 @@ class Favorite(models.Model):
         on_delete=models.CASCADE,
     )
 
+    objects = UserRecipeQuerySet.as_manager()
+
     class Meta:
         constraints = [
             UniqueConstraint(
@@ -241,3 +466,239 @@ class Favorite(models.Model):
 
     def __str__(self) -> str:
         return f"{self.recipe} - {self.user}"
+
+
+class FeedItemQuerySet(models.QuerySet):
+    """Набор запросов к лентам подписок (inbox)."""
+
+    def fill(self, users=None, authors=None, chunk_size=1000):
+        """
+        Добавляет в ленты users рецепты авторов authors, на которых
+        они подписаны. None - без ограничения. Заполняются только
+        ленты пользователей с включённым inbox, уже добавленные
+        рецепты пропускаются.
+        """
+
+        subscriptions = Subscription.objects.filter(
+            user__feed_inbox=True, author__user_recipes__isnull=False
+        )
+        if users is not None:
+            subscriptions = subscriptions.filter(user__in=users)
+        if authors is not None:
+            subscriptions = subscriptions.filter(author__in=authors)
+        rows = subscriptions.values_list(
+            'user', 'author__user_recipes', 'author__user_recipes__pub_date'
+        ).iterator()
+        while chunk := list(islice(rows, chunk_size)):
+            self.bulk_create(
+                [
+                    self.model(user_id=user, recipe_id=recipe,
+                               pub_date=pub_date)
+                    for user, recipe, pub_date in chunk
+                ],
+                ignore_conflicts=True
+            )
+
+
+class FeedItem(models.Model):
+    """
+    Рецепт в ленте подписчика - заранее собранный inbox.
+    Ведётся только для пользователей с feed_inbox: их лента
+    читается по индексу (user, pub_date), сколько бы авторов
+    они ни читали. Заполняется сигналами и rebuild_feed_inboxes.
+    """
+
+    user = models.ForeignKey(
+        to=CustomUser,
+        verbose_name='Подписчик',
+        related_name='feed_items',
+        on_delete=models.CASCADE,
+    )
+    recipe = models.ForeignKey(
+        to=Recipe,
+        verbose_name='Рецепт',
+        related_name='feed_items',
+        on_delete=models.CASCADE,
+    )
+    # Копия даты рецепта: сортировка ленты идёт по индексу этой таблицы.
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации'
+    )
+
+    objects = FeedItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='feed_item_user_recipe'
+            )
+        ]
+        indexes = [
+            Index(
+                fields=('user', 'pub_date', 'recipe'),
+                name='feed_item_user_pub_date_idx'
+            )
+        ]
+        verbose_name = 'Рецепт в ленте'
+        verbose_name_plural = 'Ленты подписок'
+
+    def __str__(self) -> str:
+        return f"{self.user} - {self.recipe}"
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+    """Набор запросов к суммарным спискам покупок."""
+
+    def get_totals(self, users=None, ingredients=None):
+        """
+        Суммы ингредиентов по корзинам, посчитанные по живым данным:
+        {(id пользователя, id ингредиента): количество}.
+        """
+
+        # Условия на корзину задаются одним filter(), чтобы
+        # Django не добавил второй JOIN и не удвоил суммы.
+        lookups = {'recipe__shopping_cart__user__isnull': False}
+        if users is not None:
+            lookups['recipe__shopping_cart__user__in'] = users
+        if ingredients is not None:
+            lookups['ingredient__in'] = ingredients
+        totals = RecipeIngredient.objects.filter(**lookups).values_list(
+            'recipe__shopping_cart__user', 'ingredient'
+        ).annotate(total=Sum('amount'))
+        return {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total in totals
+        }
+
+    def refresh(self, users=None, ingredients=None):
+        """
+        Пересчитывает строки списков покупок для пар
+        (пользователь, ингредиент) из users и ingredients.
+        None - без ограничения. Пересчёт ограничен только
+        затронутыми парами, запись - один upsert.
+        Строки пользователей users блокируются до конца транзакции:
+        иначе два параллельных изменения корзины посчитают суммы
+        каждое без чужого и последний upsert затрёт первый.
+        FOR NO KEY UPDATE не мешает вставкам в корзину и избранное.
+        """
+
+        with transaction.atomic():
+            if users is not None:
+                list(
+                    CustomUser.objects.filter(pk__in=users).order_by(
+                        'pk'
+                    ).select_for_update(no_key=True).values_list(
+                        'pk', flat=True
+                    )
+                )
+            totals = self.get_totals(users, ingredients)
+            stored = self.all()
+            if users is not None:
+                stored = stored.filter(user__in=users)
+            if ingredients is not None:
+                stored = stored.filter(ingredient__in=ingredients)
+            stale = [
+                pk for pk, user_id, ingredient_id in stored.values_list(
+                    'id', 'user', 'ingredient'
+                )
+                if (user_id, ingredient_id) not in totals
+            ]
+            if stale:
+                self.filter(pk__in=stale).delete()
+            self.bulk_create(
+                [
+                    self.model(user_id=user_id, ingredient_id=ingredient_id,
+                               amount=total)
+                    for (user_id, ingredient_id), total in totals.items()
+                ],
+                update_conflicts=True,
+                unique_fields=('user', 'ingredient'),
+                update_fields=('amount',)
+            )
+
+    def refresh_for_recipe(self, recipe, ingredients=None):
+        """
+        Пересчитывает списки покупок всех, у кого рецепт в корзине.
+        По умолчанию - только по ингредиентам этого рецепта.
+        """
+
+        if ingredients is None:
+            ingredients = list(
+                RecipeIngredient.objects.filter(
+                    recipe=recipe
+                ).values_list('ingredient', flat=True)
+            )
+        users = list(
+            ShoppingCart.objects.filter(
+                recipe=recipe
+            ).values_list('user', flat=True)
+        )
+        if users and ingredients:
+            self.refresh(users, ingredients)
+
+
+class ShoppingListItem(models.Model):
+    """
+    Суммарное количество ингредиента в корзине пользователя.
+    Поддерживается при изменении корзины и ингредиентов рецептов,
+    сверяется командой rebuild_shopping_lists.
+    """
+
+    user = models.ForeignKey(
+        to=CustomUser,
+        verbose_name='Пользователь',
+        related_name='shopping_list',
+        on_delete=models.CASCADE,
+    )
+    ingredient = models.ForeignKey(
+        to=Ingredient,
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE,
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество'
+    )
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='shopping_list_user_ingredient'
+            )
+        ]
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Списки покупок'
+
+    def __str__(self) -> str:
+        return f"{self.user} - {self.ingredient}: {self.amount}"
+
+
+class ShoppingListPDF(models.Model):
+    """
+    Задача на рендер PDF списка покупок. Её выполняет команда
+    render_shopping_lists в отдельном процессе, а не веб-воркер;
+    после удачного рендера строка удаляется, файл остаётся
+    в api.shopping.pdf_storage.
+    """
+
+    name = models.CharField(
+        verbose_name='Файл',
+        max_length=100,
+        primary_key=True
+    )
+    ingredients = models.JSONField(verbose_name='Ингредиенты')
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name='Неудачных попыток',
+        default=0
+    )
+    updated = models.DateTimeField(verbose_name='Изменена', auto_now=True)
+
+    class Meta:
+        verbose_name = 'PDF списка покупок'
+        verbose_name_plural = 'PDF списков покупок'
+
+    def __str__(self) -> str:
+        return self.name
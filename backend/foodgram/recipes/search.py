@@ -0,0 +1,72 @@
+from bisect import bisect_left, bisect_right
+from heapq import nsmallest
+from sys import maxunicode
+from threading import Lock
+
+from core.parametrs import Parameters
+from core.versions import INGREDIENTS_VERSION, get_version
+from .models import Ingredient
+
+
+class IngredientIndex:
+    """
+    Индекс названий ингредиентов в памяти процесса
+    для автодополнения по префиксу.
+    Хранит пару (отсортированные названия в нижнем регистре,
+    параллельный список строк ответа) одним атрибутом data, чтобы
+    поиск в другом потоке не увидел списки из разных сборок;
+    поиск - бинарный (bisect). Перестраивается, когда меняется
+    версия INGREDIENTS_VERSION.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.data = ([], [])
+        self.lock = Lock()
+
+    def build(self):
+        ingredients = sorted(
+            (name.lower(), pk, name, measurement_unit)
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+        )
+        keys = [ingredient[0] for ingredient in ingredients]
+        rows = [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for _, pk, name, measurement_unit in ingredients
+        ]
+        self.data = (keys, rows)
+
+    def refresh(self):
+        """Перестраивает индекс, если ингредиенты изменились."""
+
+        version = get_version(INGREDIENTS_VERSION)
+        if version == self.version:
+            return
+        with self.lock:
+            if version != self.version:
+                self.build()
+                self.version = version
+
+    def search(self, prefix, limit=Parameters.INGREDIENTS_SEARCH_LIMIT.value):
+        """
+        Ингредиенты, название которых начинается с prefix.
+        Сначала точное совпадение, затем более короткие названия.
+        """
+
+        self.refresh()
+        keys, rows = self.data
+        prefix = prefix.strip().lower()
+        start = bisect_left(keys, prefix)
+        stop = bisect_right(keys, prefix + chr(maxunicode), lo=start)
+        found = nsmallest(
+            limit, range(start, stop),
+            key=lambda index: (
+                keys[index] != prefix, len(keys[index]), index
+            )
+        )
+        return [rows[index] for index in found]
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,182 @@
+import logging
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.versions import (INGREDIENTS_VERSION, RECIPE_VERSION,
+                           RECIPES_VERSION, TAGS_VERSION, bump_version)
+from users.models import CustomUser, Subscription
+from .images import (IMAGE_ERRORS, SOURCE, delete_derivatives, is_actual,
+                     save_derivatives)
+from .models import (Favorite, FeedItem, Ingredient, Recipe,
+                     RecipeIngredient, RecipeTag, ShoppingCart, Tag)
+
+logger = logging.getLogger(__name__)
+
+# Поля автора, которые выводятся в рецептах.
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+# Модель -> (модель со счётчиком, поле связи с ней, счётчик).
+COUNTERS = {
+    Recipe: (CustomUser, 'author_id', 'recipes_count'),
+    Subscription: (CustomUser, 'author_id', 'followers_count'),
+    Favorite: (Recipe, 'recipe_id', Favorite.recipe_counter),
+    ShoppingCart: (Recipe, 'recipe_id', ShoppingCart.recipe_counter),
+}
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredients_changed(**kwargs):
+    """
+    Любое изменение ингредиента делает устаревшими
+    индекс поиска и ETag справочника.
+    """
+
+    bump_version(INGREDIENTS_VERSION)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tags_changed(**kwargs):
+    """Любое изменение тега делает устаревшим ETag справочника."""
+
+    bump_version(TAGS_VERSION)
+
+
+def make_recipe_derivatives(recipe):
+    """Уменьшенные копии текущего изображения рецепта recipe."""
+
+    if is_actual(recipe):
+        # Рецепт сохраняли в транзакции несколько раз.
+        return
+    old = recipe.image_derivatives
+    name = recipe.image.name
+    try:
+        derivatives, updated = save_derivatives(
+            Recipe.objects.filter(pk=recipe.pk, image=name), name
+        )
+    except IMAGE_ERRORS:
+        logger.exception('Не удалось уменьшить %s', name)
+        return
+    if not updated:
+        # Изображение успели заменить, копии сделает следующий вызов.
+        delete_derivatives(derivatives)
+        return
+    recipe.image_derivatives = derivatives
+    # Старые копии могут быть общими с другими рецептами.
+    if old and not Recipe.objects.filter(image=old.get(SOURCE)).exists():
+        delete_derivatives(old)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_changed(instance, **kwargs):
+    """
+    Для нового изображения рецепта создаются уменьшенные копии.
+    Делается после фиксации транзакции: запрос не держит блокировки
+    на время обработки, а откат не оставляет копий без рецепта.
+    Пока копий нет, сериализаторы отдают исходник.
+    """
+
+    if not instance.image or is_actual(instance):
+        return
+    transaction.on_commit(partial(make_recipe_derivatives, instance))
+
+
+def bump_recipe_version(recipe_id):
+    bump_version(RECIPES_VERSION)
+    bump_version(RECIPE_VERSION.format(recipe_id))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_changed(instance, **kwargs):
+    """Изменение рецепта делает устаревшими закэшированные ответы."""
+
+    bump_recipe_version(instance.pk)
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+@receiver((post_save, post_delete), sender=RecipeTag)
+def recipe_relation_changed(instance, **kwargs):
+    bump_recipe_version(instance.recipe_id)
+
+
+@receiver(post_save, sender=CustomUser)
+def author_changed(instance, created, update_fields, **kwargs):
+    """
+    Автор выводится во всех своих рецептах. Вход пользователя
+    (сохранение last_login) на ответы не влияет.
+    """
+
+    if created or (
+        update_fields is not None and not AUTHOR_FIELDS & set(update_fields)
+    ):
+        return
+    bump_version(RECIPES_VERSION)
+    for pk in instance.user_recipes.values_list('pk', flat=True):
+        bump_version(RECIPE_VERSION.format(pk))
+
+
+def change_counter(sender, instance, delta):
+    model, field, counter = COUNTERS[sender]
+    model.objects.filter(pk=getattr(instance, field)).update(
+        **{counter: Greatest(F(counter) + delta, 0)}
+    )
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Subscription)
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def counted_created(sender, instance, created, raw, **kwargs):
+    """
+    Счётчики COUNTERS меняются в сигналах, чтобы их не обходили
+    админка и каскадные удаления (рецепты и подписки удалённого
+    пользователя, избранное удалённого рецепта). Массовые вставки
+    без сигналов (generate_dataset) пересчитывают счётчики сами.
+    """
+
+    if created and not raw:
+        change_counter(sender, instance, 1)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Subscription)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def counted_deleted(sender, instance, **kwargs):
+    change_counter(sender, instance, -1)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(instance, created, **kwargs):
+    """Новый рецепт попадает в inbox подписчиков автора."""
+
+    if not created:
+        return
+    FeedItem.objects.bulk_create(
+        [
+            FeedItem(user_id=user, recipe=instance,
+                     pub_date=instance.pub_date)
+            for user in Subscription.objects.filter(
+                author=instance.author_id, user__feed_inbox=True
+            ).values_list('user', flat=True)
+        ],
+        ignore_conflicts=True
+    )
+
+
+@receiver(post_save, sender=Subscription)
+def subscription_created(instance, created, **kwargs):
+    """В inbox нового подписчика попадают все рецепты автора."""
+
+    if created and instance.user.feed_inbox:
+        FeedItem.objects.fill((instance.user_id,), (instance.author_id,))
+
+
+@receiver(post_delete, sender=Subscription)
+def subscription_deleted(instance, **kwargs):
+    FeedItem.objects.filter(
+        user=instance.user_id, recipe__author=instance.author_id
+    ).delete()
@@ -0,0 +1,133 @@
+import json
+import shutil
+import tempfile
+from io import StringIO
+from types import SimpleNamespace
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from api.filters import RecipeFilter
+from api.shopping import get_ingredients_queryset
+from api.views import RecipeViewSet
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import CustomUser, Subscription
+
+PAGE_SIZE = 6
+# Сколько строк узел плана может прочитать без условия по индексу.
+# Большие таблицы набора generate_dataset по умолчанию не меньше,
+# так что их полный обход не пройдёт.
+MAX_SCANNED_ROWS = 1000
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def get_full_scans(plan):
+    """
+    Узлы EXPLAIN ANALYZE, которые без условия по индексу (seq scan или
+    обход индекса) прочитали не меньше MAX_SCANNED_ROWS строк.
+    """
+
+    scans = []
+    if (
+        plan['Node Type'] in ('Seq Scan', 'Index Scan', 'Index Only Scan')
+        and 'Index Cond' not in plan
+    ):
+        rows = plan['Actual Loops'] * (
+            plan['Actual Rows'] + plan.get('Rows Removed by Filter', 0)
+        )
+        if rows >= MAX_SCANNED_ROWS:
+            scans.append(
+                f'{plan["Node Type"]} '
+                f'{plan.get("Index Name", plan["Relation Name"])}: {rows}'
+            )
+    for child in plan.get('Plans', ()):
+        scans.extend(get_full_scans(child))
+    return scans
+
+
+@skipUnless(
+    connection.vendor == 'postgresql', 'Планы проверяются на PostgreSQL.'
+)
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class QueryPlansTest(TestCase):
+    """
+    Запросы RecipeFilter, поиска ингредиентов, подписок, ленты и
+    списка покупок на данных generate_dataset идут по индексам.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # Размеры по умолчанию: на маленьких таблицах seq scan честно
+        # дешевле индекса.
+        call_command('generate_dataset', stdout=StringIO())
+        call_command(
+            'rebuild_feed_inboxes', min_subscriptions=1, stdout=StringIO()
+        )
+        # Подписан только на автора без рецептов.
+        author, cls.reader = CustomUser.objects.bulk_create(
+            CustomUser(username=name, email=f'{name}@example.com')
+            for name in ('author', 'reader')
+        )
+        Subscription.objects.create(user=cls.reader, author=author)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.user = CustomUser.objects.order_by('pk').first()
+        cls.tag = Tag.objects.order_by('pk').first()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def get_recipes(self, **data):
+        """Выборка рецептов так, как её строит RecipeViewSet."""
+
+        return RecipeFilter(
+            data,
+            queryset=Recipe.objects.with_user_flags(self.user),
+            request=SimpleNamespace(user=self.user)
+        ).qs.order_by(*RecipeViewSet.cursor_ordering)[:PAGE_SIZE]
+
+    def get_feed(self, user, inbox):
+        """Лента так, как её строит RecipeViewSet.feed."""
+
+        user = CustomUser(pk=user.pk, feed_inbox=inbox)
+        return Recipe.objects.feed(user).with_user_flags(user).order_by(
+            '-feed_pub_date', '-id'
+        )[:PAGE_SIZE]
+
+    def get_queries(self):
+        return {
+            'recipes': self.get_recipes(),
+            'recipes?author': self.get_recipes(author=self.user.pk),
+            'recipes?tags': self.get_recipes(tags=[self.tag.slug]),
+            'recipes?is_favorited': self.get_recipes(is_favorited='true'),
+            'recipes?is_in_shopping_cart': self.get_recipes(
+                is_in_shopping_cart='true'
+            ),
+            'ingredients?name': Ingredient.objects.filter(
+                name__istartswith='а'
+            ),
+            'users/subscriptions': CustomUser.objects.filter(
+                author__user=self.user
+            ).order_by('username', 'id')[:PAGE_SIZE],
+            'users/subscriptions recipes': Recipe.objects.filter(
+                author=self.user
+            ).order_by('-pub_date', '-id')[:PAGE_SIZE],
+            'download_shopping_cart': get_ingredients_queryset(self.user),
+            'recipes/feed': self.get_feed(self.user, False),
+            'recipes/feed inbox': self.get_feed(self.user, True),
+            'recipes/feed empty': self.get_feed(self.reader, False),
+        }
+
+    def test_queries_use_indexes(self):
+        for name, queryset in self.get_queries().items():
+            with self.subTest(name):
+                plan = json.loads(
+                    queryset.explain(format='json', analyze=True)
+                )
+                self.assertEqual(
+                    get_full_scans(plan[0]['Plan']), [], queryset.explain()
+                )
@@ -37,6 +37,10 @@ class UsernameFilterCustomUser(SimpleListFilter):
 
 class FilterCustomUser(admin.ModelAdmin):
     list_filter = (UsernameFilterCustomUser, 'email',)
+    # Нужен для автодополнения автора в админке рецептов.
+    search_fields = ('^username', '^email',)
+    # Счётчики меняются только F-выражениями.
+    readonly_fields = ('recipes_count', 'followers_count',)
 
 
 admin.site.register(CustomUser, FilterCustomUser)
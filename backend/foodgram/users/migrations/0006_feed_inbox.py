@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-18 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='feed_inbox',
+            field=models.BooleanField(default=False, verbose_name='Лента из inbox'),
+        ),
+    ]
@@ -1,14 +1,72 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
+from django.contrib.postgres.indexes import OpClass
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Exists, F, Index, OuterRef, Value
+from django.db.models.functions import Upper
 
+from core.expressions import count_related
+from core.models import CountersModelMixin
 from core.parametrs import Parameters
 from .validators import validate_username
 
 
-class CustomUser(AbstractUser):
+class CustomUserQuerySet(models.QuerySet):
+    """Набор запросов к пользователям."""
+
+    def with_subscription(self, user):
+        """
+        Аннотирует пользователей флагом is_subscribed:
+        подписан ли на них user. Один подзапрос на всю выборку.
+        """
+
+        if not user.is_authenticated:
+            return self.annotate(is_subscribed=Value(False))
+        return self.annotate(
+            is_subscribed=Exists(
+                Subscription.objects.filter(
+                    user=user, author=OuterRef('pk')
+                )
+            )
+        )
+
+    def with_actual_counters(self):
+        """
+        Аннотирует пользователей счётчиками,
+        посчитанными по живым данным.
+        """
+
+        return self.annotate(
+            actual_recipes_count=count_related(CustomUser, 'user_recipes'),
+            actual_followers_count=count_related(CustomUser, 'author')
+        )
+
+    def drifted_counters(self):
+        """Пользователи, у которых счётчики разошлись с живыми данными."""
+
+        return self.with_actual_counters().exclude(
+            recipes_count=F('actual_recipes_count'),
+            followers_count=F('actual_followers_count')
+        )
+
+    def recount(self):
+        """Пересчитывает счётчики одним UPDATE на всю выборку."""
+
+        return self.update(
+            recipes_count=count_related(CustomUser, 'user_recipes'),
+            followers_count=count_related(CustomUser, 'author')
+        )
+
+
+class CustomUserManager(UserManager.from_queryset(CustomUserQuerySet)):
+    """Менеджер пользователей с дополнительными аннотациями."""
+
+
+class CustomUser(CountersModelMixin, AbstractUser):
     """Кастомная модель пользователя."""
 
+    counter_fields = ('recipes_count', 'followers_count')
+
     # Замена логина.
     USERNAME_FIELD = 'email'
     # Что будет запрашиваться при createsuperuser
@@ -39,11 +97,42 @@ class CustomUser(AbstractUser):
         verbose_name='Пароль',
         max_length=128
     )
+    # Счётчики обновляются F-выражениями в recipes.signals,
+    # сверяются командой reconcile_counters.
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Рецептов',
+        default=0,
+        editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Подписчиков',
+        default=0,
+        editable=False
+    )
+    # Включается командой rebuild_feed_inboxes для тех,
+    # кто подписан на очень многих авторов.
+    feed_inbox = models.BooleanField(
+        verbose_name='Лента из inbox',
+        default=False
+    )
+
+    objects = CustomUserManager()
 
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
         ordering = ("username",)
+        indexes = [
+            # Поиск в админке по началу юзернейма и почты.
+            Index(
+                OpClass(Upper('username'), name='text_pattern_ops'),
+                name='user_username_upper_idx'
+            ),
+            Index(
+                OpClass(Upper('email'), name='text_pattern_ops'),
+                name='user_email_upper_idx'
+            )
+        ]
 
     def __str__(self) -> str:
         return f"{self.username}: {self.email}"
@@ -1,3 +1,6 @@
+// how many times to poll for a PDF that is still being rendered
+const MAX_DOWNLOAD_ATTEMPTS = 30
+
 class Api {
   constructor (url, headers) {
     this._url = url
@@ -385,7 +388,7 @@ class Api {
     ).then(this.checkResponse)
   }
 
-  downloadFile () {
+  downloadFile (attempt = 1) {
     const token = localStorage.getItem('token')
     return fetch(
       `/api/recipes/download_shopping_cart/`,
@@ -396,7 +399,18 @@ class Api {
           'authorization': `Token ${token}`
         }
       }
-    ).then(this.checkFileDownloadResponse)
+    ).then(res => {
+      // 202 means the PDF is still being rendered, retry a bit later
+      if (res.status === 202) {
+        if (attempt >= MAX_DOWNLOAD_ATTEMPTS) {
+          return Promise.reject()
+        }
+        const delay = Number(res.headers.get('Retry-After') || 1) * 1000
+        return new Promise(resolve => setTimeout(resolve, delay))
+          .then(() => this.downloadFile(attempt + 1))
+      }
+      return this.checkFileDownloadResponse(res)
+    })
   }
 }
 
@@ -31,6 +31,9 @@ const Cart = ({ updateOrders, orders }) => {
 
   const downloadDocument = () => {
     api.downloadFile()
+      .catch(_ => {
+        alert('Не удалось подготовить список покупок, попробуйте позже')
+      })
   }
 
   return <Main>